@@ -3,13 +3,16 @@ import random
 import logging
 
 from django.conf import settings
-from django.db import transaction, models
+from django.core.cache import cache
+from django.db import DatabaseError, transaction, models
 
 import cronjobs
 from product_details.version_compare import Version
 
 import input
-from feedback.models import Opinion, VersionCount, extract_terms
+from feedback import spool
+from feedback.models import (Opinion, VersionCount, parse_user_agent,
+                             save_terms)
 
 
 DEFAULT_NUM_OPINIONS = 100
@@ -55,13 +58,17 @@ DEVICES = dict(Samsung='Epic Vibrant Transform'.split(),
                Motorola='DroidX Droid2'.split())
 logger = logging.getLogger(__name__)
 
+SPOOL_LOCK = settings.CACHE_PREFIX + 'feedback:spool_lock'
+SPOOL_LOCK_TIMEOUT = 60 * 10
+TERMS_LOCK = settings.CACHE_PREFIX + 'feedback:terms_lock'
+TERMS_LOCK_TIMEOUT = 60 * 60
+# The id of the last opinion extract_terms went through.
+TERMS_MARK = settings.CACHE_PREFIX + 'feedback:terms_mark'
+
 
 @cronjobs.register
 @transaction.commit_on_success
 def populate(num_opinions=None, product='mobile', type=None, locale=None):
-    models.signals.post_save.disconnect(extract_terms, sender=Opinion,
-                                        dispatch_uid='extract_terms')
-
     if not num_opinions:
         num_opinions = getattr(settings, 'NUM_FAKE_OPINIONS',
                                DEFAULT_NUM_OPINIONS)
@@ -92,9 +99,6 @@ def populate(num_opinions=None, product='mobile', type=None, locale=None):
                 seconds=random.randint(0, 30 * 24 * 3600))
         o.save()
 
-    models.signals.post_save.connect(extract_terms, sender=Opinion,
-                                     dispatch_uid='extract_terms')
-
 
 @cronjobs.register
 def version_counter():
@@ -116,3 +120,139 @@ def version_counter():
             vc.active = (
                 vc.num_opinions >= settings.DASHBOARD_THRESHOLD_MOBILE)
         vc.save()
+
+
+@cronjobs.register
+def flush_opinions(batch=None):
+    """
+    Saves the feedback spooled by the feedback view (c.f.
+    settings.ASYNC_OPINIONS) with one INSERT per batch, then extracts
+    their terms and queues them for indexing.  Records leave the spool
+    only once they are queued for indexing.  Run every minute.
+    """
+    from search import tasks
+
+    batch = int(batch or settings.OPINION_SPOOL_BATCH)
+    if not cache.add(SPOOL_LOCK, 1, SPOOL_LOCK_TIMEOUT):
+        logger.info('Spool is being flushed already, skipping.')
+        return
+    try:
+        while True:
+            records = spool.pending(batch)
+            if not records:
+                break
+            _save_spooled([(filename, record) for filename, record in records
+                           if 'id' not in record])
+
+            saved = [(filename, record['id']) for filename, record in records
+                     if 'id' in record]
+            if not saved:
+                continue
+            ids = [id for filename, id in saved]
+            _save_terms(ids)
+            tasks.add_to_index.delay(ids)
+            spool.remove(filename for filename, id in saved)
+            logger.debug('Saved %d spooled opinions.' % len(saved))
+    finally:
+        cache.delete(SPOOL_LOCK)
+
+
+def _save_terms(ids):
+    """
+    Extracts the terms of the opinions with ``ids``, unless extract_terms
+    is running.  Either way, the extract_terms cron gets to them later on.
+    """
+    if not cache.add(TERMS_LOCK, 1, TERMS_LOCK_TIMEOUT):
+        return
+    try:
+        save_terms(list(Opinion.objects.no_cache()
+                        .filter(pk__in=ids).only('description')))
+    except Exception:
+        logger.exception('Extracting terms of spooled opinions failed.')
+    finally:
+        cache.delete(TERMS_LOCK)
+
+
+def _save_spooled(records):
+    """
+    Inserts spooled (filename, record) pairs with a single INSERT and marks
+    them saved in the spool.  If that fails, they are inserted one by one,
+    and the ones that fail again are quarantined.
+    """
+    opinions = []
+    for filename, record in records:
+        try:
+            opinion = spool.record_opinion(record)
+        except (KeyError, ValueError), e:
+            spool.quarantine(filename, 'Malformed record: %r' % e)
+            continue
+        parse_user_agent(Opinion, opinion)
+        if not opinion.product:
+            spool.quarantine(filename, 'Unknown user agent.')
+            continue
+        opinions.append((filename, record, opinion))
+
+    try:
+        Opinion.objects.bulk_insert([o for f, r, o in opinions])
+    except DatabaseError:
+        transaction.rollback_unless_managed()
+        logger.exception('Saving %d spooled opinions failed, saving them '
+                         'one by one.' % len(opinions))
+        saved = []
+        for filename, record, opinion in opinions:
+            try:
+                Opinion.objects.bulk_insert([opinion])
+            except DatabaseError, e:
+                transaction.rollback_unless_managed()
+                spool.quarantine(filename, e)
+            else:
+                saved.append((filename, record, opinion))
+        opinions = saved
+
+    for filename, record, opinion in opinions:
+        spool.mark_saved(filename, record, opinion.id)
+
+
+@cronjobs.register
+def extract_terms(backfill=None):
+    """
+    Extracts the terms of the opinions saved since the last run, in
+    batches of TERMS_BATCH.  Run every minute.  With backfill, it goes
+    through all opinions instead, e.g.:
+
+        ./manage.py cron extract_terms backfill
+    """
+    if not cache.add(TERMS_LOCK, 1, TERMS_LOCK_TIMEOUT):
+        logger.info('Terms are being extracted already, skipping.')
+        return
+    try:
+        if backfill:
+            last = 0
+        else:
+            last = cache.get(TERMS_MARK)
+        if last is None:
+            last = (Opinion.terms.through.objects
+                    .aggregate(last=models.Max('opinion'))['last'] or 0)
+
+        # Ids don't commit in order, so the mark may have passed some.
+        skipped = list(Opinion.objects.no_cache()
+                       .filter(pk__gt=max(last - settings.TERMS_RESCAN, 0),
+                               pk__lte=last, terms__isnull=True)
+                       .only('description'))
+        if skipped:
+            save_terms(skipped)
+            logger.debug('Extracted terms of %d skipped opinions.' %
+                         len(skipped))
+
+        while True:
+            opinions = list(Opinion.objects.no_cache()
+                            .filter(pk__gt=last).only('description')
+                            .order_by('id')[:settings.TERMS_BATCH])
+            if not opinions:
+                break
+            save_terms(opinions)
+            last = opinions[-1].id
+            cache.set(TERMS_MARK, last, 60 * 60 * 24 * 30)
+            logger.debug('Extracted terms up to opinion %d.' % last)
+    finally:
+        cache.delete(TERMS_LOCK)
@@ -0,0 +1,66 @@
+import random
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from topia.termextract import extract
+
+from feedback import utils
+from feedback.cron import sample
+
+# Short feedback that comes in over and over again.
+REPEATED = ['crashes', 'slow', 'Firefox is slow', 'too slow', 'crash',
+            'love it', 'flash crashes']
+
+
+def descriptions(number):
+    """Made up feedback: mostly unique texts, some very common ones."""
+    return [random.choice(REPEATED) if random.random() < 0.3 else sample()
+            for i in xrange(number)]
+
+
+def fresh_extract(text):
+    """extract_terms as it used to be: a new extractor for every text."""
+    extractor = extract.TermExtractor()
+    extractor.filter = extract.permissiveFilter
+    return [t[0].lower() for t in extractor(text) if t[2] == 1]
+
+
+class Command(BaseCommand):
+    """
+    Times term extraction per opinion with a new extractor each time, with
+    the process' shared extractor, and with the shared extractor plus the
+    cache of extracted terms (c.f. feedback.utils.extract_terms).
+    """
+    help = 'Time term extraction per opinion.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('-n',
+                    action='store',
+                    type='int',
+                    dest='number',
+                    default=200,
+                    help='Number of opinions to extract terms from.'),
+    )
+
+    def handle(self, *args, **options):
+        texts = descriptions(options['number'])
+        utils.term_extractor()  # Load the shared extractor up front.
+
+        def shared(text):
+            utils._terms_cache.clear()
+            return utils.extract_terms(text)
+
+        for name, extract_terms in (('new extractor', fresh_extract),
+                                    ('shared', shared),
+                                    ('shared, cached', utils.extract_terms)):
+            utils._terms_cache.clear()
+            start = time.time()
+            for text in texts:
+                extract_terms(text)
+            elapsed = time.time() - start
+            print '%-16s %.3f ms per opinion' % (name,
+                                                 elapsed / len(texts) * 1000)
+        print 'cache: %(hits)d hits, %(misses)d misses' % (
+            utils._terms_cache.stats())
@@ -1,25 +1,51 @@
+import unicodedata
 from datetime import timedelta
 
 from django.conf import settings
-from django.db import models
+from django.core.cache import cache
+from django.db import connections, models, router, transaction
 from django.db.models import Count, signals
 
 import caching.base
 import commonware.log
+from statsd import statsd
 from elasticutils import es_required
 from pyes import djangoutils
 from pyes.exceptions import NotFoundException as PyesNotFoundException
-from product_details.version_compare import Version
 
 from feedback import query, utils
-from feedback.utils import ua_parse, extract_terms, smart_truncate
+from feedback.utils import ua_parse, smart_truncate
 from input import PRODUCT_IDS, OPINION_TYPES, OPINION_PRAISE, PLATFORMS
 from input.models import ModelBase
 from input.urlresolvers import reverse
+from input.utils import version_int
 
 log = commonware.log.getLogger('feedback')
 
 
+def opinion_cache_key(pk):
+    return '%sopinion:%s' % (settings.CACHE_PREFIX, pk)
+
+
+def insert_many(model, columns, rows, ignore=False):
+    """
+    Insert rows (sequences of column values) into a model's table with a
+    single multi-row INSERT, and return the cursor.
+    """
+    using = router.db_for_write(model)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    row = '(%s)' % ', '.join(['%s'] * len(columns))
+    sql = 'INSERT %sINTO %s (%s) VALUES %s' % (
+        'IGNORE ' if ignore else '', qn(model._meta.db_table),
+        ', '.join(qn(c) for c in columns), ', '.join([row] * len(rows)))
+
+    cursor = connection.cursor()
+    cursor.execute(sql, [value for r in rows for value in r])
+    transaction.commit_unless_managed(using=using)
+    return cursor
+
+
 class OpinionManager(caching.base.CachingManager):
     def browse(self, **kwargs):
         """Browse all opinions, restricted by search criteria."""
@@ -35,6 +61,58 @@ class OpinionManager(caching.base.CachingManager):
 
         return qs
 
+    def get_many_cached(self, pks):
+        """
+        Opinions with the given primary keys, in that order, with a single
+        cache round-trip.  Only the cache misses are fetched from the DB.
+        """
+        if not pks:
+            return []
+
+        keys = dict((pk, opinion_cache_key(pk)) for pk in pks)
+        cached = cache.get_many(keys.values())
+        found = dict((pk, cached[key]) for pk, key in keys.items()
+                     if key in cached)
+
+        missing = [pk for pk in pks if pk not in found]
+        statsd.incr('opinion.cache.hits', len(found))
+        statsd.incr('opinion.cache.misses', len(missing))
+        if missing:
+            fetched = self.no_cache().in_bulk(missing)
+            found.update(fetched)
+            cache.set_many(dict((opinion_cache_key(pk), obj) for pk, obj in
+                                fetched.iteritems()),
+                           settings.OPINION_CACHE_TIMEOUT)
+
+        return [found[pk] for pk in pks if pk in found]
+
+    def bulk_insert(self, opinions):
+        """
+        Save unsaved opinions with a single multi-row INSERT and set their
+        ids.  No save signals are sent, so the caller parses the user agent
+        beforehand and does the term and index work afterwards.
+
+        This relies on MySQL handing out consecutive ids to the rows of a
+        multi-row INSERT, which it does unless innodb_autoinc_lock_mode is
+        set to 2 ("interleaved").
+        """
+        if not opinions:
+            return []
+
+        connection = connections[router.db_for_write(self.model)]
+        fields = [f for f in self.model._meta.local_fields
+                  if not isinstance(f, models.AutoField)]
+        rows = [[f.get_db_prep_save(getattr(o, f.attname),
+                                    connection=connection) for f in fields]
+                for o in opinions]
+
+        cursor = insert_many(self.model, [f.column for f in fields], rows)
+        first_id = connection.ops.last_insert_id(
+            cursor, self.model._meta.db_table, self.model._meta.pk.column)
+        for i, opinion in enumerate(opinions):
+            opinion.id = first_id + i
+        return opinions
+
     def between(self, date_start=None, date_end=None):
         ret = self.get_query_set()
         if date_start:
@@ -141,15 +219,30 @@ def parse_user_agent(sender, instance, **kw):
         instance.platform = parsed['platform']
 
 
-# TODO: add this to celery
-def extract_terms(sender, instance, **kw):
-    if instance.terms.all() or settings.DISABLE_TERMS:
+def save_terms(opinions):
+    """
+    Extract and save the terms of a batch of opinions, with one lookup of
+    the known terms, one INSERT of the new ones and one INSERT linking
+    them to the opinions.  Opinions that have terms already are skipped.
+    (c.f. the extract_terms cron)
+    """
+    if settings.DISABLE_TERMS or not opinions:
         return
-    terms = (t for t in utils.extract_terms(instance.description) if
-             len(t) >= settings.MIN_TERM_LENGTH)
-    for term in terms:
-        this_term, created = Term.objects.get_or_create(term=term)
-        instance.terms.add(this_term)
+
+    through = Opinion.terms.through
+    done = set(through.objects.filter(opinion__in=[o.id for o in opinions])
+                              .values_list('opinion', flat=True))
+    found = dict((o.id, set(utils.extract_terms(o.description)))
+                 for o in opinions if o.id not in done)
+
+    ids = Term.objects.get_ids(set().union(*found.values()))
+    rows = [(opinion, ids[term]) for opinion, terms in found.iteritems()
+            for term in terms if term in ids]
+    if rows:
+        # IGNORE: flush_opinions and the extract_terms cron may both get to
+        # an opinion.
+        insert_many(through, ('opinion_id', 'term_id'), rows, ignore=True)
+
 
 def post_to_elastic(sender, instance, **kw):
     """Asynchronously update the opinion in ElasticSearch."""
@@ -157,15 +250,31 @@ def post_to_elastic(sender, instance, **kw):
     tasks.add_to_index.delay([instance.id])
 
 signals.pre_save.connect(parse_user_agent, sender=Opinion)
-signals.post_save.connect(extract_terms, sender=Opinion,
-                          dispatch_uid='extract_terms')
 signals.post_save.connect(post_to_elastic, sender=Opinion)
 
 unindex_opinion = lambda instance, **kwargs: instance.remove_from_index()
 signals.post_delete.connect(unindex_opinion, sender=Opinion)
 
+
+def uncache_opinion(sender, instance, **kw):
+    """Drop an opinion from the per-opinion cache when it changes."""
+    cache.delete(opinion_cache_key(instance.pk))
+
+signals.post_save.connect(uncache_opinion, sender=Opinion,
+                          dispatch_uid='uncache_opinion')
+signals.post_delete.connect(uncache_opinion, sender=Opinion,
+                            dispatch_uid='uncache_opinion')
+
 # post_Save for POST to metrics
 
+def collation_key(term):
+    """Approximates how MySQL's utf8_general_ci compares terms: without
+    case and accents."""
+    decomposed = unicodedata.normalize('NFKD', unicode(term))
+    return u''.join(c for c in decomposed
+                    if not unicodedata.combining(c)).lower()
+
+
 class TermManager(models.Manager):
     def get_query_set(self):
         """Use a query that won't use left joins."""
@@ -176,6 +285,41 @@ class TermManager(models.Manager):
         """All but hidden terms."""
         return self.filter(hidden=False)
 
+    def get_ids(self, terms):
+        """
+        Ids of the given terms, keyed by term.  The missing ones are created
+        with a single INSERT.
+
+        The DB compares terms ignoring case and accents, so a term can come
+        back as a different, equivalent one (u'cafe' as u'caf\xe9').
+        """
+        def lookup(terms):
+            found = self.get_query_set().no_cache().filter(
+                term__in=list(terms))
+            by_key = dict((collation_key(term), pk) for pk, term in
+                          found.values_list('id', 'term'))
+            return dict((term, by_key[collation_key(term)]) for term in terms
+                        if collation_key(term) in by_key)
+
+        if not terms:
+            return {}
+        ids = lookup(terms)
+        missing = [term for term in terms if term not in ids]
+        if missing:
+            # Terms are unique, IGNORE skips the ones created concurrently.
+            insert_many(self.model, ('term', 'hidden'),
+                        [(term, False) for term in missing], ignore=True)
+            ids.update(lookup(missing))
+        # Whatever collation_key got wrong, the DB knows better.
+        for term in terms:
+            if term not in ids:
+                try:
+                    ids[term] = self.get_query_set().no_cache().get(
+                        term=term).pk
+                except self.model.DoesNotExist:
+                    log.error('Term %r was neither found nor created.' % term)
+        return ids
+
     def frequent(self, opinions=None, date_start=None, date_end=None,
                  **kwargs):
         """Frequently used terms in a given timeframe."""
@@ -236,8 +380,7 @@ class VersionCount(ModelBase):
 
 def update_version_int(sender, instance, **kwargs):
     if not instance.pk:
-        v = Version(instance.version)
-        instance.version_int = v._version_int
+        instance.version_int = version_int(instance.version)
 
 
 signals.pre_save.connect(update_version_int, sender=VersionCount)
@@ -0,0 +1,114 @@
+"""
+A durable local spool for feedback submissions.
+
+With settings.ASYNC_OPINIONS on, the feedback view only appends the
+submitted form to the spool, and the flush_opinions cron saves spooled
+opinions in bulk.  Every record is its own file, written to a temporary
+name, fsync'ed and renamed into place, so a crash never leaves half a
+record behind.  Saved records get the id of their opinion and stay in the
+spool until they are queued for indexing, too.  Records that cannot be
+saved are quarantined to a .bad file next to the others.
+"""
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+
+from django.conf import settings
+
+import commonware.log
+
+log = commonware.log.getLogger('feedback')
+
+SUFFIX = '.json'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _spool_dir():
+    path = settings.OPINION_SPOOL_DIR
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:  # Another process beat us to it.
+            pass
+    return path
+
+
+def _write(filename, record):
+    path, name = os.path.split(filename)
+    tmp = os.path.join(path, '.' + name)
+    with open(tmp, 'w') as f:
+        json.dump(record, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp, filename)
+
+
+def enqueue(record):
+    """Append a single opinion record (a dict) to the spool."""
+    name = '%.6f-%s' % (time.time(), uuid.uuid4().hex)
+    _write(os.path.join(_spool_dir(), name + SUFFIX), record)
+
+
+def mark_saved(filename, record, id):
+    """Add the ``id`` of its saved opinion to a record, in the spool too."""
+    record['id'] = id
+    _write(filename, record)
+
+
+def quarantine(filename, reason):
+    """Take a record that cannot be saved out of the spool."""
+    log.error('Quarantining spooled opinion %s: %s' % (
+        os.path.basename(filename), reason))
+    try:
+        os.rename(filename, filename + '.bad')
+    except OSError:
+        pass
+
+
+def pending(limit=None):
+    """The oldest spooled records as (filename, record) pairs."""
+    path = _spool_dir()
+    names = sorted(n for n in os.listdir(path) if n.endswith(SUFFIX))
+    records = []
+    for name in names[:limit]:
+        filename = os.path.join(path, name)
+        try:
+            with open(filename) as f:
+                records.append((filename, json.load(f)))
+        except (IOError, ValueError), e:
+            quarantine(filename, e)
+    return records
+
+
+def remove(filenames):
+    """Drop records from the spool once they are saved and indexed."""
+    for filename in filenames:
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+
+def opinion_record(opinion):
+    """A compact, JSON-serializable record of an unsaved opinion."""
+    return {'type': opinion._type,
+            'url': opinion.url,
+            'description': opinion.description,
+            'user_agent': opinion.user_agent,
+            'locale': opinion.locale,
+            'manufacturer': opinion.manufacturer,
+            'device': opinion.device,
+            'created': opinion.created.strftime(DATE_FORMAT)}
+
+
+def record_opinion(record):
+    """The unsaved opinion for a spooled record."""
+    from feedback.models import Opinion
+    return Opinion(
+        _type=record['type'], url=record['url'],
+        description=record['description'], user_agent=record['user_agent'],
+        locale=record['locale'], manufacturer=record['manufacturer'],
+        device=record['device'],
+        created=datetime.strptime(record['created'], DATE_FORMAT))
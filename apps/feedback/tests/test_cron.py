@@ -1,8 +1,20 @@
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError
+
 import test_utils
+from mock import patch
 from nose.tools import eq_
 
 import input
-from feedback.cron import populate, DEFAULT_NUM_OPINIONS
+from feedback import spool
+from feedback.cron import (extract_terms, flush_opinions, populate,
+                           DEFAULT_NUM_OPINIONS, TERMS_LOCK, TERMS_MARK)
 from feedback.models import Opinion
 
 
@@ -16,3 +28,111 @@ class TestPopulate(test_utils.TestCase):
         count = Opinion.objects.filter(
                 _type=input.OPINION_IDEA.id).count()
         eq_(count, DEFAULT_NUM_OPINIONS)
+
+
+class TestExtractTerms(test_utils.TestCase):
+    @patch.object(settings._wrapped, 'TERMS_RESCAN', 0)
+    @patch.object(settings._wrapped, 'DISABLE_TERMS', False)
+    def test_extract_terms(self):
+        """New opinions get terms; backfill goes through all of them."""
+        old = Opinion.objects.create(product=1,
+                                     description='This is an old test')
+        cache.set(TERMS_MARK, old.id)
+        new = Opinion.objects.create(product=1,
+                                     description='This is a new test')
+
+        extract_terms()
+        eq_(old.terms.count(), 0)
+        assert 'test' in [t.term for t in new.terms.all()]
+        eq_(cache.get(TERMS_MARK), new.id)
+
+        extract_terms('backfill')
+        assert 'test' in [t.term for t in old.terms.all()]
+
+    @patch.object(settings._wrapped, 'DISABLE_TERMS', False)
+    def test_skipped(self):
+        """Opinions saved after the mark passed their id get terms, too."""
+        skipped = Opinion.objects.create(product=1,
+                                         description='This is a late test')
+        new = Opinion.objects.create(product=1,
+                                     description='This is a new test')
+        cache.set(TERMS_MARK, new.id)
+        extract_terms()
+        assert 'test' in [t.term for t in skipped.terms.all()]
+
+
+class TestFlushOpinions(test_utils.TestCase):
+    UA = ('Mozilla/5.0 (Windows; U; Windows NT 6.1; en-US; rv:1.9.2.4) '
+          'Gecko/20100611 Firefox/20.0b2')
+
+    def setUp(self):
+        self.spool_dir = tempfile.mkdtemp()
+        self.patch = patch.object(settings._wrapped, 'OPINION_SPOOL_DIR',
+                                  self.spool_dir)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.spool_dir)
+
+    def enqueue(self, **kwargs):
+        o = Opinion(_type=input.OPINION_ISSUE.id, description='Spooled',
+                    user_agent=self.UA, created=datetime.now(), **kwargs)
+        spool.enqueue(spool.opinion_record(o))
+
+    def test_quarantine(self):
+        """Records that can't be saved don't hold up the others."""
+        self.enqueue()
+        self.enqueue(url='http://broken.example.com/')
+        spool.enqueue({'type': 1})
+        count = Opinion.objects.no_cache().count()
+
+        bulk_insert = Opinion.objects.bulk_insert
+
+        def failing_insert(opinions):
+            if [o for o in opinions if 'broken' in o.url]:
+                raise DatabaseError('Broken row.')
+            return bulk_insert(opinions)
+
+        with patch.object(Opinion.objects, 'bulk_insert', failing_insert):
+            flush_opinions()
+        eq_(Opinion.objects.no_cache().count(), count + 1)
+        eq_(spool.pending(), [])
+        eq_(len([f for f in os.listdir(self.spool_dir)
+                 if f.endswith('.bad')]), 2)
+
+    @patch('search.tasks.add_to_index.delay')
+    def test_index_failure(self, delay):
+        """Saved records stay spooled until they are queued for indexing,
+        and aren't saved twice."""
+        self.enqueue()
+        count = Opinion.objects.no_cache().count()
+        delay.side_effect = IOError('Broker is down.')
+        try:
+            flush_opinions()
+        except IOError:
+            pass
+        (filename, record), = spool.pending()
+        assert record['id']
+
+        delay.side_effect = None
+        flush_opinions()
+        delay.assert_called_with([record['id']])
+        eq_(spool.pending(), [])
+        eq_(Opinion.objects.no_cache().count(), count + 1)
+
+    @patch('feedback.cron.save_terms')
+    def test_terms_lock(self, save_terms):
+        """Terms aren't extracted while extract_terms runs."""
+        self.enqueue()
+        cache.set(TERMS_LOCK, 1)
+        try:
+            flush_opinions()
+        finally:
+            cache.delete(TERMS_LOCK)
+        eq_(save_terms.call_count, 0)
+        eq_(spool.pending(), [])
+
+        self.enqueue()
+        flush_opinions()
+        eq_(save_terms.call_count, 1)
@@ -1,9 +1,11 @@
 """Test feedback.utils."""
 from django import http
 
+from mock import patch
 from nose.tools import eq_
 
 from input import FIREFOX, MOBILE
+from feedback import utils
 from feedback.utils import detect_language, ua_parse, smart_truncate
 
 
@@ -46,6 +48,10 @@ def test_ua_parse():
         # Valid modern Firefox for Android
         ('Mozilla/5.0 (Android; Mobile; rv:18.0) Gecko/18.0 Firefox/18.0',
          MOBILE, '18.0', 'android'),
+        # Android wins over Linux, wherever it is in the string.
+        ('Mozilla/5.0 (Linux; Android 4.0; Mobile; rv:18.0) Gecko/18.0 '
+         'Firefox/18.0',
+         MOBILE, '18.0', 'android'),
 
         # valid Firefox OS
         ('Mozilla/5.0 (Mobile; rv:19.0) Gecko/19.0 Firefox/19.0',
@@ -74,6 +80,26 @@ def test_ua_parse():
         yield test_ua_item, pattern
 
 
+def test_ua_parse_cache():
+    """Parsed user agents are cached, in a bounded cache."""
+    ua = ('Mozilla/5.0 (Windows; U; Windows NT 6.1; en-US; rv:1.9.2.4) '
+          'Gecko/20100611 Firefox/3.6.4')
+    utils.ua_parse_cache.clear()
+    with patch.object(utils, '_ua_parse') as parse:
+        parse.return_value = None
+        eq_(ua_parse(ua), None)
+        eq_(ua_parse(ua), None)
+        eq_(parse.call_count, 1)
+    eq_(utils.ua_parse_cache.stats(), {'size': 1, 'hits': 1, 'misses': 1})
+
+    utils.ua_parse_cache.clear()
+    with patch.object(utils.ua_parse_cache, 'size', 2):
+        for i in range(3):
+            ua_parse(ua + str(i))
+        eq_(len(utils.ua_parse_cache), 2)
+    utils.ua_parse_cache.clear()
+
+
 def test_detect_language():
     """Check Accept-Language matching for feedback submission."""
     patterns = (
@@ -99,3 +125,14 @@ def test_smart_truncate():
     for pattern in patterns:
         eq_(smart_truncate(pattern[0], length=pattern[1]), pattern[2])
 
+
+
+def test_extract_terms_cached():
+    """One extractor per process; repeated texts come from the cache."""
+    eq_(utils.term_extractor(), utils.term_extractor())
+    utils._terms_cache.clear()
+    with patch.object(utils, 'term_extractor') as term_extractor:
+        term_extractor.return_value.return_value = [('Crash', 'NN', 1)]
+        eq_(utils.extract_terms(u'crashes'), ['crash'])
+        eq_(utils.extract_terms(u'crashes'), ['crash'])
+        eq_(term_extractor.return_value.call_count, 1)
@@ -1,9 +1,12 @@
 import random
+import shutil
 import string
+import tempfile
 from datetime import datetime
 
 from django.conf import settings
 
+from mock import patch
 from nose.tools import eq_
 from pyquery import PyQuery as pq
 
@@ -11,6 +14,8 @@ import input
 from input import FIREFOX, OPINION_PRAISE, OPINION_ISSUE
 from input.tests import ViewTestCase, enforce_ua
 from input.urlresolvers import reverse
+from feedback import spool
+from feedback.cron import flush_opinions
 from feedback.models import Opinion
 
 
@@ -179,6 +184,35 @@ class ViewTests(ViewTestCase):
         eq_(latest.manufacturer, 'FancyBrand')
         eq_(latest.device, 'FancyPhone 2.0')
 
+    def test_async_submission(self):
+        """With ASYNC_OPINIONS, feedback is spooled and saved by cron."""
+        spool_dir = tempfile.mkdtemp()
+        count = Opinion.objects.no_cache().count()
+        try:
+            with patch.object(settings._wrapped, 'ASYNC_OPINIONS', True):
+                with patch.object(settings._wrapped, 'OPINION_SPOOL_DIR',
+                                  spool_dir):
+                    r = self.client.post(
+                        reverse('feedback'), {
+                            'description': 'Spooled!',
+                            '_type': OPINION_ISSUE.id,
+                        }, HTTP_USER_AGENT=(self.FX_UA % '20.0b2'),
+                        follow=True)
+                    assert r.content.find('Thanks') >= 0
+                    eq_(Opinion.objects.no_cache().count(), count)
+                    eq_(len(spool.pending()), 1)
+
+                    flush_opinions()
+                    eq_(spool.pending(), [])
+        finally:
+            shutil.rmtree(spool_dir)
+
+        eq_(Opinion.objects.no_cache().count(), count + 1)
+        latest = Opinion.objects.no_cache().order_by('-id')[0]
+        eq_(latest.description, 'Spooled!')
+        eq_(latest.product, FIREFOX.id)
+        eq_(latest.version, '20.0b2')
+
     def test_feedback_index(self):
         """Test feedback index page for Betas."""
         r = self.client.get(reverse('feedback'),
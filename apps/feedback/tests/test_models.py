@@ -6,7 +6,7 @@ from mock import patch
 from test_utils import eq_, TestCase
 
 from input import FIREFOX, WINDOWS_7
-from feedback.models import Opinion, Term
+from feedback.models import Opinion, Term, collation_key, save_terms
 from feedback.stats import frequent_terms
 
 
@@ -51,6 +51,27 @@ class TermTestCase(TestCase):
         freq = frequent_terms(qs=ts)
         eq_(len(freq), 2)
 
+    def test_get_ids(self):
+        """Terms are found however the DB spells them, or created."""
+        ids = Term.objects.get_ids([u'hello', u'new'])
+        eq_(ids[u'hello'], self.t1.id)
+        eq_(ids[u'new'], Term.objects.get(term=u'new').id)
+
+    def test_collation_key(self):
+        eq_(collation_key(u'Caf\xe9'), u'cafe')
+        eq_(collation_key('Hello'), u'hello')
+
+    @patch.object(settings._wrapped, 'DISABLE_TERMS', False)
+    def test_save_terms_twice(self):
+        """Saving the terms of an opinion twice at once doesn't fail."""
+        op = Opinion.objects.create(product=1, description='This is a test')
+        with patch('feedback.models.Opinion.terms.through.objects.filter') \
+                as done:
+            done.return_value.values_list.return_value = []
+            save_terms([op])
+            save_terms([op])
+        eq_([t.term for t in op.terms.all()], ['test'])
+
     def test_unicode(self):
         """Term's unicode representation."""
         t = Term(term='Hello')
@@ -59,11 +80,46 @@ class TermTestCase(TestCase):
     @patch.object(settings._wrapped, 'DISABLE_TERMS', False)
     def test_term_extraction(self):
         """Make sure we create our terms."""
-        settings.DISABLE_TERMS = False
         op = Opinion.objects.create(product=1, description='This is a test')
+        eq_(list(op.terms.all()), [])
+        save_terms([op])
         terms = [term.term for term in op.terms.all()]
         eq_(terms, ['test'])
 
+    @patch.object(settings._wrapped, 'DISABLE_TERMS', False)
+    def test_save_terms_batch(self):
+        """Terms are shared across a batch, and known terms are reused."""
+        ops = [Opinion.objects.create(product=1, description=d) for d in
+               ('This is a test', 'This is another test')]
+        save_terms(ops)
+        eq_(Term.objects.filter(term='test').count(), 1)
+        for op in ops:
+            assert 'test' in [t.term for t in op.terms.all()]
+
+        # Opinions with terms are left alone.
+        count = ops[0].terms.count()
+        save_terms(ops)
+        eq_(ops[0].terms.count(), count)
+
+
+class OpinionCacheTestCase(TestCase):
+    fixtures = ['feedback/opinions']
+
+    def test_get_many_cached(self):
+        """Cached opinions come back in order, and change when saved."""
+        pks = list(Opinion.objects.no_cache().values_list('pk', flat=True))
+        pks = pks[:3][::-1]
+        eq_([o.pk for o in Opinion.objects.get_many_cached(pks)], pks)
+
+        op = Opinion.objects.no_cache().get(pk=pks[0])
+        op.description = 'Changed.'
+        op.save()
+        eq_(Opinion.objects.get_many_cached(pks)[0].description, 'Changed.')
+
+    def test_get_many_cached_missing(self):
+        eq_(Opinion.objects.get_many_cached([]), [])
+        eq_(Opinion.objects.get_many_cached([999999]), [])
+
 
 @patch('django.db.models.query.QuerySet.filter')
 def test_opinion_manager_between(filter):
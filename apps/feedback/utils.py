@@ -1,7 +1,9 @@
+import hashlib
 import re
+import threading
 
 from django.conf import settings
-from django.utils.functional import memoize
+from django.utils.encoding import smart_str
 from django.utils.translation import to_locale
 from django.utils.translation.trans_real import parse_accept_lang_header
 
@@ -10,6 +12,19 @@ from product_details.version_compare import Version
 from topia.termextract import extract
 
 from input import BROWSERS, PLATFORM_OTHER, PLATFORM_PATTERNS
+from input.utils import LRUCache
+
+
+_browsers = [(browser, re.compile(pattern)) for browser, pattern in BROWSERS]
+# All platform patterns in one alternation.  The lookahead finds overlapping
+# occurrences too, so the first listed pattern in the UA wins, as before.
+_platforms = re.compile('(?=(%s))' % '|'.join(
+    re.escape(pattern) for pattern, short in PLATFORM_PATTERNS))
+_platform_ranks = dict((pattern, (rank, short)) for rank, (pattern, short)
+                       in reversed(list(enumerate(PLATFORM_PATTERNS))))
+
+ua_parse_cache = LRUCache(settings.UA_CACHE_SIZE)
+_missing = object()
 
 
 def ua_parse(ua):
@@ -23,17 +38,27 @@ def ua_parse(ua):
         locale: locale code matching locale_details, else None
         }
     or None if detection failed.
-    """
 
+    Results are kept in ua_parse_cache, of at most settings.UA_CACHE_SIZE
+    user agents.
+    """
     if not ua:
         return None
 
+    detected = ua_parse_cache.get(ua, _missing)
+    if detected is _missing:
+        detected = _ua_parse(ua)
+        ua_parse_cache.set(ua, detected)
+    return detected
+
+
+def _ua_parse(ua):
     # Detect browser
     detected = {}
-    for browser in BROWSERS:
-        match = re.match(browser[1], ua)
+    for browser, pattern in _browsers:
+        match = pattern.match(ua)
         if match:
-            detected['browser'] = browser[0]
+            detected['browser'] = browser
             try:
                 version = Version(match.group(2))
                 detected['version'] = str(version)
@@ -45,16 +70,10 @@ def ua_parse(ua):
         return None
 
     # Detect Platform
-    platform = PLATFORM_OTHER.short
-    for pattern in PLATFORM_PATTERNS:
-        if ua.find(pattern[0]) >= 0:
-            platform = pattern[1]
-            break
-    detected['platform'] = platform
+    found = [_platform_ranks[m] for m in _platforms.findall(ua)]
+    detected['platform'] = min(found)[1] if found else PLATFORM_OTHER.short
 
     return detected
-_ua_parse_cache = {}
-ua_parse = memoize(ua_parse, _ua_parse_cache, 1)
 
 
 def detect_language(request):
@@ -79,20 +98,46 @@ def detect_language(request):
     return ''
 
 
+_extractor = None
+_extractor_lock = threading.Lock()
+# Terms of recently seen descriptions, which repeat a lot ("crashes").
+_terms_cache = LRUCache(settings.TERMS_CACHE_SIZE)
+
+
+def term_extractor():
+    """
+    The term extractor of this process, built (which loads the tagger's
+    lexicon) on first use.  Extracting terms only reads the lexicon, so
+    threads can share it.
+    """
+    global _extractor
+    if _extractor is None:
+        with _extractor_lock:
+            if _extractor is None:
+                extractor = extract.TermExtractor()
+                # Use permissive filter to find all possibly relevant terms
+                # in short texts.
+                extractor.filter = extract.permissiveFilter
+                _extractor = extractor
+    return _extractor
+
+
 def extract_terms(text):
     """
     Use topia.termextract to perform a simple tag extraction from
     user comments.
     """
-    extractor = extract.TermExtractor()
-    # Use permissive filter to find all possibly relevant terms in short texts.
-    extractor.filter = extract.permissiveFilter
-    terms = extractor(text)
-
-    # Collect terms in lower case, but only the ones that consist of single
-    # words (t[2] == 1), and are at most 25 chars long.
-    return [t[0].lower() for t in terms if t[2] == 1 and
-            settings.MIN_TERM_LENGTH <= len(t[0]) <= settings.MAX_TERM_LENGTH]
+    key = hashlib.md5(smart_str(text)).digest()
+    terms = _terms_cache.get(key)
+    if terms is None:
+        # Collect terms in lower case, but only the ones that consist of
+        # single words (t[2] == 1), and are at most 25 chars long.
+        terms = tuple(
+            t[0].lower() for t in term_extractor()(text) if t[2] == 1 and
+            settings.MIN_TERM_LENGTH <= len(t[0]) <= settings.MAX_TERM_LENGTH)
+        if settings.TERMS_CACHE_SIZE:
+            _terms_cache.set(key, terms)
+    return list(terms)
 
 
 def smart_truncate(content, length=100, suffix='...'):
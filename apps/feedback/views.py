@@ -1,3 +1,4 @@
+from datetime import datetime
 from functools import wraps
 
 from django import http
@@ -6,18 +7,23 @@ from django.shortcuts import get_object_or_404, render
 from django.views.decorators.cache import never_cache
 
 import jingo
-from product_details.version_compare import Version
 from session_csrf import anonymous_csrf_exempt
 from tower import ugettext as _
 
 import input
 from input.decorators import cache_page, forward_mobile
 from input.urlresolvers import reverse
+from input.utils import version_int
+from feedback import spool
 from feedback.forms import PraiseForm, IssueForm, IdeaForm
 from feedback.models import Opinion
 from feedback.utils import detect_language, ua_parse
 
 
+MIN_VERSION_INTS = dict((browser, version_int(browser.min_version))
+                        for browser, pattern in input.BROWSERS)
+
+
 def enforce_ua(f):
     """
     View decorator enforcing feedback from the right (latest beta, latest
@@ -42,10 +48,9 @@ def enforce_ua(f):
         if not settings.ENFORCE_USER_AGENT:
             return f(request, ua=ua, *args, **kwargs)
 
-        this_ver = Version(parsed['version'])
-        ref_ver = Version(parsed['browser'].min_version)
         # Check for outdated release.
-        if this_ver < ref_ver:
+        if (version_int(parsed['version']) <
+            MIN_VERSION_INTS[parsed['browser']]):
             return http.HttpResponseRedirect(reverse('feedback.download'))
 
         # If we made it here, it's a valid version.
@@ -146,6 +151,12 @@ def save_opinion_from_form(request, type, ua, form):
         locale=locale,
         manufacturer=form.cleaned_data['manufacturer'],
         device=form.cleaned_data['device'])
-    opinion.save()
+
+    if settings.ASYNC_OPINIONS:
+        # Saved in bulk later on by the flush_opinions cron.
+        opinion.created = datetime.now()
+        spool.enqueue(spool.opinion_record(opinion))
+    else:
+        opinion.save()
 
     return opinion
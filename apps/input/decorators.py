@@ -1,13 +1,17 @@
 from functools import wraps
 import re
+import time
 import urllib
 
 from django.conf import settings
 from django.contrib.sites.models import Site
+from django.core.cache import cache
 from django.http import HttpResponseRedirect
+from django.utils.cache import (get_cache_key, learn_cache_key,
+                                patch_response_headers)
 from django.utils.hashcompat import md5_constructor
 
-from view_cache_utils import cache_page_with_prefix
+from statsd import statsd
 
 
 # Known mobile device patterns. Excludes iPad because it's big enough to show
@@ -16,10 +20,30 @@ MOBILE_DEVICE_PATTERN = re.compile(
     r'^Mozilla.*(Fennec|Android|Maemo|iPhone|iPod|Mobile)', re.IGNORECASE)
 
 
-def cache_page(cache_timeout=None, use_get=False, **kwargs):
+def canonical_get(data):
+    """
+    An order independent query string of the non-empty parameters in GET
+    ``data``.
+    """
+    # Only sort by name; the order of repeated parameters matters.
+    return urllib.urlencode(sorted(((k, v.encode('utf-8'))
+                                    for k, values in data.lists()
+                                    for v in values if v),
+                                   key=lambda item: item[0]))
+
+
+def cache_page(cache_timeout=None, use_get=False, grace=0, get_key=None,
+               **kwargs):
     """
     Cache an entire page with a cache prefix based on the Site ID and
-    (optionally) the GET parameters.
+    (optionally) the GET parameters.  ``get_key(request)`` can replace the
+    default key of the GET parameters (c.f. ``canonical_get``) by one that
+    knows which parameters are equivalent.
+
+    Only one request at a time renders a missing page; concurrent requests
+    for it wait up to CACHE_PAGE_WAIT seconds for that to finish.  For
+    ``grace`` seconds after a page expires, one request renders it again
+    while the others are served the stale copy.
     """
     # If the first argument is a callable, we've used the decorator without
     # args.
@@ -30,17 +54,70 @@ def cache_page(cache_timeout=None, use_get=False, **kwargs):
     if cache_timeout is None:
         cache_timeout = settings.CACHE_DEFAULT_PERIOD
 
+    if get_key:
+        use_get = True
+    else:
+        get_key = lambda request: canonical_get(request.GET)
+
     def key_prefix(request):
         prefix = '%ss%d:' % (settings.CACHE_PREFIX, settings.SITE_ID)
         if use_get:
-            prefix += md5_constructor(str(request.GET)).hexdigest()
+            prefix += md5_constructor(get_key(request)).hexdigest()
         return prefix
 
+    def cached(request, prefix):
+        """The cached (expiry, response) of the page, if any."""
+        key = get_cache_key(request, prefix)
+        return cache.get(key) if key else None
+
     def wrap(f):
         @wraps(f)
-        @cache_page_with_prefix(cache_timeout, key_prefix)
         def cached_view(request, *args, **kwargs):
-            return f(request, *args, **kwargs)
+            if request.method not in ('GET', 'HEAD'):
+                return f(request, *args, **kwargs)
+
+            prefix = key_prefix(request)
+            entry = cached(request, prefix)
+            if entry and entry[0] > time.time():
+                statsd.incr('cache_page.hit')
+                return entry[1]
+
+            lock = '%slock:%s' % (prefix, md5_constructor(
+                request.path.encode('utf-8')).hexdigest())
+            if not cache.add(lock, 1, settings.CACHE_PAGE_LOCK_TIMEOUT):
+                if entry:
+                    # Someone else is on it; make do with the stale page.
+                    statsd.incr('cache_page.stale')
+                    return entry[1]
+
+                # Someone else is rendering it; wait for them.
+                statsd.incr('cache_page.wait')
+                waited = 0
+                while waited < settings.CACHE_PAGE_WAIT:
+                    time.sleep(0.1)
+                    waited += 0.1
+                    entry = cached(request, prefix)
+                    if entry:
+                        return entry[1]
+                    if cache.get(lock) is None:
+                        # They gave up (errors aren't cached), no use
+                        # waiting any longer.
+                        break
+                lock = None  # Render it ourselves.
+
+            statsd.incr('cache_page.miss')
+            try:
+                response = f(request, *args, **kwargs)
+                if response.status_code == 200:
+                    patch_response_headers(response, cache_timeout)
+                    key = learn_cache_key(request, response,
+                                          cache_timeout + grace, prefix)
+                    cache.set(key, (time.time() + cache_timeout, response),
+                              cache_timeout + grace)
+                return response
+            finally:
+                if lock:
+                    cache.delete(lock)
         return cached_view
     return wrap
 
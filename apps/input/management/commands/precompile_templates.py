@@ -0,0 +1,15 @@
+from django.core.management.base import NoArgsCommand
+
+from input.utils import precompile_templates
+
+
+class Command(NoArgsCommand):
+    """
+    Compile all Jinja templates into the bytecode cache, so that workers
+    don't compile them on their first requests.  Run on deploy.
+    """
+    help = 'Compile all Jinja templates into the bytecode cache.'
+
+    def handle_noargs(self, **options):
+        count = precompile_templates()
+        print 'Compiled %d templates.' % count
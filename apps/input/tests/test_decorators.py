@@ -1,4 +1,9 @@
+import time
+
 from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpRequest, HttpResponse, QueryDict
+from django.utils.hashcompat import md5_constructor
 
 from mock import patch
 from test_utils import eq_
@@ -93,3 +98,94 @@ class DecoratorTests(ViewTestCase):
                             r.status_code / 100 == 3 and  # some redirect...
                             # ... but not to the mobile domain.
                             r['Location'].find(fake_mobile_domain) == -1)
+
+
+def test_canonical_get():
+    """Parameter order and empty parameters don't matter."""
+    eq_(decorators.canonical_get(QueryDict('q=&product=firefox&b=1&b=0')),
+        decorators.canonical_get(QueryDict('b=1&b=0&product=firefox')))
+    eq_(decorators.canonical_get(QueryDict('q=%C3%A9t%C3%A9&a=1')),
+        'a=1&q=%C3%A9t%C3%A9')
+    assert (decorators.canonical_get(QueryDict('b=1&b=0')) !=
+            decorators.canonical_get(QueryDict('b=0&b=1')))
+
+
+def cached_view(**kwargs):
+    """A cache_page'd view counting its renders in ``view.renders``."""
+    @decorators.cache_page(**kwargs)
+    def view(request):
+        view.renders += 1
+        return HttpResponse('render %d' % view.renders)
+    view.renders = 0
+    return view
+
+
+def get(view, path, query=''):
+    request = HttpRequest()
+    request.method = 'GET'
+    request.path = path
+    request.GET = QueryDict(query)
+    return view(request).content
+
+
+def lock_key(path):
+    """The key of cache_page's render lock for ``path``."""
+    return '%ss%d:lock:%s' % (settings.CACHE_PREFIX, settings.SITE_ID,
+                              md5_constructor(path).hexdigest())
+
+
+def test_cache_page():
+    view = cached_view(cache_timeout=60)
+    eq_(get(view, '/cached/'), 'render 1')
+    eq_(get(view, '/cached/'), 'render 1')
+    eq_(get(view, '/cached/other/'), 'render 2')
+    # Without use_get, the query string doesn't matter.
+    eq_(get(view, '/cached/', 'utm_source=x'), 'render 1')
+
+
+def test_cache_page_grace():
+    """Expired pages are served while someone else renders them again."""
+    view = cached_view(cache_timeout=60, grace=60)
+    eq_(get(view, '/cached/grace/'), 'render 1')
+
+    later = time.time() + 90
+    with patch('time.time', lambda: later):
+        with patch('input.decorators.cache.add', lambda *args: False):
+            eq_(get(view, '/cached/grace/'), 'render 1')
+        eq_(get(view, '/cached/grace/'), 'render 2')
+    eq_(view.renders, 2)
+
+
+@patch.object(settings._wrapped, 'CACHE_PAGE_WAIT', 0.25)
+@patch('input.decorators.time.sleep')
+def test_cache_page_wait(sleep):
+    """Missing pages being rendered elsewhere are waited for, for a while."""
+    view = cached_view(cache_timeout=60)
+    cache.set(lock_key('/cached/wait/'), 1)
+    with patch('input.decorators.cache.add', lambda *args: False):
+        eq_(get(view, '/cached/wait/'), 'render 1')
+    eq_(sleep.call_count, 3)
+    cache.delete(lock_key('/cached/wait/'))
+
+
+@patch('input.decorators.time.sleep')
+def test_cache_page_failed_render(sleep):
+    """Waiting stops once the other render gave up."""
+    view = cached_view(cache_timeout=60)
+    cache.set(lock_key('/cached/failed/'), 1)
+    sleep.side_effect = lambda s: cache.delete(lock_key('/cached/failed/'))
+    with patch('input.decorators.cache.add', lambda *args: False):
+        eq_(get(view, '/cached/failed/'), 'render 1')
+    eq_(sleep.call_count, 1)
+
+
+def test_cache_page_error_unlocks():
+    """A render that raises releases its lock."""
+    @decorators.cache_page(cache_timeout=60)
+    def view(request):
+        raise ValueError
+    try:
+        get(view, '/cached/error/')
+    except ValueError:
+        pass
+    eq_(cache.get(lock_key('/cached/error/')), None)
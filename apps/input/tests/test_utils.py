@@ -0,0 +1,50 @@
+from mock import Mock, patch
+from nose.tools import eq_
+
+from input.utils import (LRUCache, id_order, precompile_templates,
+                         template_names, version_int)
+
+
+def test_id_order():
+    """Objects come back in the order of the ids; missing ones are skipped."""
+    objs = [Mock(pk=pk) for pk in (1, 2, 3)]
+    qs = Mock()
+    qs.filter.return_value = objs
+
+    eq_([o.pk for o in id_order(qs, [3, 1, 4, 2])], [3, 1, 2])
+    eq_(id_order(qs, []), [])
+
+
+def test_template_names():
+    names = list(template_names())
+    assert 'base.html' in names
+    assert 'search/search.html' in names
+    assert 'search/mobile/search.html' in names
+
+
+@patch('jingo.env.get_template')
+def test_precompile_templates(get_template):
+    eq_(precompile_templates(), len(list(template_names())))
+    get_template.assert_called_with(list(template_names())[-1])
+
+
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    eq_(cache.get('a'), 1)
+    cache.set('c', 3)  # Drops b, the least recently used.
+    eq_(cache.get('b'), None)
+    eq_(cache.get('b', 'missing'), 'missing')
+    eq_(cache.get('c'), 3)
+    eq_(cache.stats(), {'size': 2, 'hits': 2, 'misses': 2})
+
+
+def test_version_int():
+    """Version ints compare like versions, and are cached."""
+    assert version_int('4.0b1') < version_int('4.0') < version_int('4.0.1')
+    assert version_int('3.6.13') < version_int('4.0')
+    with patch('input.utils.Version') as Version:
+        Version.return_value._version_int = 1
+        version_int('4.0')
+        assert not Version.called
@@ -1,5 +1,15 @@
+import os
+import threading
 import zlib
 
+from django.conf import settings
+
+import commonware.log
+import jinja2
+from product_details.version_compare import Version
+
+log = commonware.log.getLogger('i.utils')
+
 
 # TODO(davedash): liberate this
 def manual_order(qs, pks, pk_name='id'):
@@ -19,4 +29,130 @@ def manual_order(qs, pks, pk_name='id'):
     return objects
 
 
+def id_order(qs, pks):
+    """
+    Given a query set and a list of primary keys, return a list of objects
+    from the query set in that exact order.
+
+    Unlike ``manual_order`` this sorts in Python, so MySQL can answer a plain
+    ``IN`` query without a filesort.  Objects missing from the query set are
+    left out.
+    """
+    if not pks:
+        return []
+
+    objects = dict((obj.pk, obj) for obj in qs.filter(pk__in=pks))
+    return [objects[pk] for pk in pks if pk in objects]
+
+
 crc32 = lambda x: zlib.crc32(x) & 0xffffffff
+
+
+def template_names():
+    """The names of all templates in the project and apps template dirs."""
+    dirs = [os.path.join(settings.ROOT, 'apps', app, 'templates')
+            for app in sorted(os.listdir(os.path.join(settings.ROOT, 'apps')))]
+    for tpl_dir in list(settings.TEMPLATE_DIRS) + dirs:
+        for dirpath, dirnames, filenames in os.walk(tpl_dir):
+            for name in sorted(filenames):
+                if name.endswith('.html'):
+                    yield os.path.relpath(os.path.join(dirpath, name), tpl_dir)
+
+
+def precompile_templates():
+    """
+    Compiles all Jinja templates ahead of their first use, which also fills
+    the shared bytecode cache (c.f. JINJA_BYTECODE_CACHE_DIR).  Returns the
+    number of templates compiled.
+    """
+    import jingo
+
+    count = 0
+    for name in template_names():
+        try:
+            jingo.env.get_template(name)
+            count += 1
+        except jinja2.TemplateError, e:
+            # E.g. Django templates of apps excluded from jingo.
+            log.debug('Not precompiling %s: %s' % (name, e))
+    return count
+
+
+class LRUCache(object):
+    """
+    A cache of at most ``size`` items, which drops the least recently used
+    ones first.  Safe to share between threads.  Counts hits and misses.
+    """
+    PREV, NEXT, KEY, VALUE = range(4)
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Keys map to the links of a circular, doubly linked list, which is
+        # in order of use: the root's NEXT is the least recently used.
+        self._data = {}
+        self._root = root = []
+        root[:] = [root, root, None, None]
+
+    def _unlink(self, link):
+        link[self.PREV][self.NEXT] = link[self.NEXT]
+        link[self.NEXT][self.PREV] = link[self.PREV]
+
+    def _append(self, link):
+        last = self._root[self.PREV]
+        link[self.PREV], link[self.NEXT] = last, self._root
+        last[self.NEXT] = self._root[self.PREV] = link
+
+    def get(self, key, default=None):
+        with self._lock:
+            link = self._data.get(key)
+            if link is None:
+                self.misses += 1
+                return default
+            self._unlink(link)
+            self._append(link)  # Most recently used now.
+            self.hits += 1
+            return link[self.VALUE]
+
+    def set(self, key, value):
+        with self._lock:
+            link = self._data.get(key)
+            if link is not None:
+                self._unlink(link)
+            link = self._data[key] = [None, None, key, value]
+            self._append(link)
+            if len(self._data) > self.size:
+                oldest = self._root[self.NEXT]
+                self._unlink(oldest)
+                del self._data[oldest[self.KEY]]
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {'size': len(self), 'hits': self.hits, 'misses': self.misses}
+
+
+_version_ints = LRUCache(1000)
+
+
+def version_int(version):
+    """
+    The integer of a version string, which compares like the version does
+    (c.f. product_details' Version).  Cached, since the same few versions
+    come up on every request.
+    """
+    vint = _version_ints.get(version)
+    if vint is None:
+        vint = Version(version)._version_int
+        _version_ints.set(version, vint)
+    return vint
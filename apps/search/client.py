@@ -1,26 +1,38 @@
+import base64
+import multiprocessing
 import os
+import Queue
 import re
+import select
 import socket
 import sys
+import threading
 import time
 from calendar import timegm
 from collections import defaultdict
-from datetime import timedelta, date
+from datetime import datetime, timedelta, date
+from multiprocessing.pool import ThreadPool
 from operator import itemgetter
 
 from django.conf import settings
+from django.core.cache import cache
+from django.utils.hashcompat import md5_constructor
 
+import commonware.log
 from product_details import product_details
 from statsd import statsd
 from tower import ugettext as _
 
 from input import (KNOWN_DEVICES, KNOWN_MANUFACTURERS, OPINION_PRAISE,
-                   OPINION_IDEA, PLATFORM_USAGE)
-from input.utils import crc32, manual_order
+                   OPINION_IDEA, PLATFORM_USAGE, PRODUCT_USAGE)
+from input.utils import crc32
 from feedback.models import Opinion
+from search.models import OpinionRollup
 
 import sphinxapi as sphinx
 
+log = commonware.log.getLogger('i.search')
+
 
 # Monkey-patch sphinx socket timeout. Default to 5s (instead of 1s)
 # but allow it to be overridden by SPHINX_TIMEOUT setting in settings.
@@ -29,6 +41,10 @@ sphinx.K_TIMEOUT = getattr(settings, 'SPHINX_TIMEOUT', 5)
 
 SPHINX_HARD_LIMIT = 1000  # A hard limit that sphinx imposes.
 
+# Meta aggregations that can be answered from search.models.OpinionRollup.
+ROLLUP_METAS = ('type', 'locale', 'platform', 'day_sentiment', 'manufacturer',
+                'device', 'version')
+
 
 def collapsed(matches, trans, name):
     """
@@ -43,6 +59,66 @@ def collapsed(matches, trans, name):
             sorted(data.items(), key=itemgetter(1), reverse=True)]
 
 
+class Crc32Registry(object):
+    """
+    Reverse maps (crc32 -> name) for the string attributes we facet on;
+    sphinx only stores their crc32s.  Each map is built on first use from
+    the registered source of known names, and rebuilt after ``invalidate``.
+    """
+
+    def __init__(self):
+        self._sources = {}
+        self._maps = {}
+        self.collisions = {}
+
+    def register(self, field, source):
+        """``source`` is a callable returning the known names of ``field``."""
+        self._sources[field] = source
+        self.invalidate(field)
+
+    def invalidate(self, field=None):
+        if field:
+            self._maps.pop(field, None)
+        else:
+            self._maps.clear()
+
+    def get(self, field):
+        """The crc32 -> name map of ``field``."""
+        names = self._maps.get(field)
+        if names is None:
+            names = self._maps[field] = self._build(field)
+        return names
+
+    def _build(self, field):
+        names = {}
+        collisions = []
+        for name in self._sources[field]():
+            key = crc32(name)
+            if names.get(key, name) != name:
+                collisions.append((names[key], name))
+                log.error('crc32 collision for %s: %r and %r' % (
+                    field, names[key], name))
+            else:
+                names[key] = name
+        self.collisions[field] = collisions
+        return names
+
+
+def _versions():
+    for prod in PRODUCT_USAGE:
+        for version in (prod.beta_versions + prod.release_versions +
+                        prod.extra_versions):
+            yield version
+
+
+crc32_names = Crc32Registry()
+crc32_names.register('platform', lambda: (p.short for p in PLATFORM_USAGE))
+crc32_names.register('manufacturer', lambda: KNOWN_MANUFACTURERS)
+crc32_names.register('device', lambda: KNOWN_DEVICES)
+crc32_names.register('locale', lambda: product_details.languages)
+crc32_names.register('version', _versions)
+
+
 def sanitize_query(term):
     term = term.strip('^$ ').replace('^$', '')
     return term
@@ -80,10 +156,16 @@ def extract_filters(kwargs):
         else:
             filters['locale'] = crc32(kwargs['locale'])
 
-    # TODO: We should allow infinite queries when we get hardware or ES
-    many_days_ago = date.today() - timedelta(days=60)
-    start = time_as_int(kwargs.get('date_start') or many_days_ago,
-                        utc=kwargs.get('utc'))
+    # Only searches asking for all dates go to all partitions (c.f.
+    # index_partitions).
+    if kwargs.get('date_start'):
+        start_date = kwargs['date_start']
+    elif kwargs.get('all_dates'):
+        start_date = first_partition()
+    else:
+        start_date = (date.today() -
+                      timedelta(days=settings.SEARCH_DEFAULT_DAYS))
+    start = time_as_int(start_date, utc=kwargs.get('utc'))
     end_date = (kwargs.get('date_end') or date.today()) + timedelta(days=1)
     end = time_as_int(end_date)
     ranges['created'] = (start, end)
@@ -91,6 +173,139 @@ def extract_filters(kwargs):
     return (filters, ranges, metas)
 
 
+def rollup_filters(kwargs, filters):
+    """
+    Turns the filtering options in kwargs into OpinionRollup query filters
+    matching what ``extract_filters`` asks of searchd.  Returns None if the
+    rollups can't count the same date range.
+    """
+    where = {}
+
+    if isinstance(kwargs.get('product'), int):
+        where['product'] = kwargs['product']
+
+    if kwargs.get('version'):
+        where['version'] = kwargs['version']
+
+    if kwargs.get('type'):
+        where['type'] = kwargs['type']
+
+    for meta in ('platform', 'manufacturer', 'device'):
+        val = kwargs.get(meta)
+        if val and val.lower() == 'unknown':
+            where[meta] = ''
+        elif val:
+            where[meta] = val
+
+    if kwargs.get('locale'):
+        if kwargs['locale'] == 'unknown':
+            where['locale'] = ''
+        else:
+            where['locale'] = kwargs['locale']
+
+    # Rollups are per local day; a range cutting through a day (say, one
+    # starting at UTC midnight) has to be counted by searchd.
+    (start, end) = filters[1]['created']
+    for t in (start, end):
+        if t != time_as_int(date.fromtimestamp(t)):
+            return None
+    where['day__gte'] = start
+    where['day__lt'] = end
+
+    return where
+
+
+def encode_cursor(opinion):
+    """
+    An opaque pagination cursor pointing right after ``opinion`` in the
+    reverse chronological order of search results.
+    """
+    position = '%d:%d' % (time_as_int(opinion.created), opinion.id)
+    return base64.urlsafe_b64encode(position).rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Returns the (created, id) a cursor points at, or None if invalid."""
+    if not cursor:
+        return None
+    try:
+        cursor = str(cursor)
+        position = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        (created, id) = map(int, position.split(':'))
+    except (TypeError, ValueError, UnicodeEncodeError):
+        return None
+    return (created, id)
+
+# Widths of the sentiment-over-time buckets packed into sphinx attributes
+# (c.f. sphinx.conf); months have no fixed width.
+SENTIMENT_BUCKETS = {'hour': 3600, 'day': 86400, 'week': 604800,
+                     'month': None}
+# Weeks start on Mondays; the epoch was a Thursday.
+WEEK_OFFSET = 3 * 86400
+
+
+def sentiment_attr(kwargs):
+    """
+    The sphinx attribute the ``day_sentiment`` meta groups by: one of
+    {hour,day,week,month}_sentiment, as picked by ``kwargs['bucket']``.
+    """
+    bucket = kwargs.get('bucket')
+    if bucket not in SENTIMENT_BUCKETS:
+        bucket = 'day'
+    return '%s_sentiment' % bucket
+
+
+def bucket_start(timestamp, bucket):
+    """The start of the ``bucket`` (e.g. 'week') ``timestamp`` falls in."""
+    if bucket == 'month':
+        # Months start at local midnight, like month_sentiment (c.f.
+        # sphinx.conf), which MySQL computes in the site's time zone.
+        d = datetime.fromtimestamp(timestamp)
+        return time_as_int(date(d.year, d.month, 1))
+    width = SENTIMENT_BUCKETS[bucket]
+    offset = WEEK_OFFSET if bucket == 'week' else 0
+    return timestamp - (timestamp + offset) % width
+
+
+def first_partition():
+    """The first day covered by the sphinx index partitions."""
+    return date(*(tuple(settings.SPHINX_PARTITION_START) + (1,)))
+
+
+def last_partition():
+    """The (year, month) of the last sphinx index partition."""
+    today = date.today()
+    return tuple(settings.SPHINX_PARTITION_END or (today.year, today.month))
+
+
+def partition_name(year, month):
+    """The name of the sphinx index partition of a month."""
+    return 'opinions_%04d_%02d' % (year, month)
+
+
+def index_partitions(start, end):
+    """
+    Names of the sphinx index partitions holding opinions created between
+    the unix timestamps ``start`` and ``end`` (exclusive).
+
+    There is one partition per month, and a delta with the opinions since
+    the last nightly merge, whichever days they were created on.  c.f.
+    configs/sphinx/sphinx.conf
+    """
+    first = max(date.fromtimestamp(max(start, 0)), first_partition())
+    last = date.fromtimestamp(min(end - 1, time.time()))
+
+    names = []
+    (year, month) = (first.year, first.month)
+    while (year, month) <= min((last.year, last.month), last_partition()):
+        names.append(partition_name(year, month))
+        (year, month) = (year + 1, 1) if month == 12 else (year, month + 1)
+
+    names.append('opinions_delta')
+
+    return ' '.join(names)
+
+
 def time_as_int(date, utc=False):
     """
     Converts a date or datetime object to a unixtimestamp.  ``utc=True``
@@ -107,18 +322,204 @@ class SearchError(Exception):
     pass
 
 
-class Client(object):
+INDEX_GENERATION_KEY = settings.CACHE_PREFIX + 'search:index_generation'
+# Longest relative expiry memcached accepts (30 days).
+INDEX_GENERATION_TIMEOUT = 60 * 60 * 24 * 30
+
+
+def index_generation():
+    """
+    The current generation of the search index.  Cached query results
+    remember the generation they were computed in, so bumping it on index
+    rotation makes them stale.
+    """
+    generation = cache.get(INDEX_GENERATION_KEY)
+    if generation is None:
+        generation = int(time.time())
+        cache.add(INDEX_GENERATION_KEY, generation, INDEX_GENERATION_TIMEOUT)
+    return generation
+
+
+def bump_index_generation():
+    """Makes all cached query results stale.  Call after index rotation."""
+    cache.set(INDEX_GENERATION_KEY, int(time.time() * 1000),
+              INDEX_GENERATION_TIMEOUT)
+
+
+def query_cache_key(term, filters, part, **kwargs):
+    """
+    Builds a cache key for one part (the primary query or a single meta
+    aggregation) of a search, from the normalized ``extract_filters`` output.
+    Equivalent searches share a key regardless of how their URLs looked.
+    The term is used as is: the ``url:*`` operator is case sensitive.
+    """
+    (includes, ranges, metas) = filters
+    normalized = (term, part,
+                  sorted(includes.items()), sorted(ranges.items()),
+                  sorted(metas.items()), sorted(kwargs.items()))
+    return '%ssearch:%s' % (settings.CACHE_PREFIX,
+                            md5_constructor(repr(normalized)).hexdigest())
+
+
+def new_sphinx_client():
+    """Returns a SphinxClient configured for our searchd."""
+    sc = sphinx.SphinxClient()
+    sc.SetMatchMode(sphinx.SPH_MATCH_BOOLEAN)
+
+    if os.environ.get('DJANGO_ENVIRONMENT') == 'test':
+        sc.SetServer(settings.SPHINX_HOST, settings.TEST_SPHINX_PORT)
+    else:  # pragma: nocover
+        sc.SetServer(settings.SPHINX_HOST, settings.SPHINX_PORT)
+    return sc
+
+
+class ConnectionPool(object):
+    """
+    A process-wide pool of SphinxClients holding persistent connections to
+    searchd (c.f. ``SphinxClient.Open``), so we don't pay for a TCP connect
+    and protocol handshake on every search.
+
+    Connections are opened lazily, up to ``size`` of them.  When all of them
+    are checked out, ``checkout`` blocks for up to ``timeout`` seconds.
+    """
+
+    def __init__(self, size=None, timeout=None):
+        self.size = size or settings.SPHINX_POOL_SIZE
+        self.timeout = timeout or settings.SPHINX_POOL_TIMEOUT
+        self._idle = Queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def _connect(self):
+        sc = new_sphinx_client()
+        # If searchd refuses a persistent connection, the client falls back
+        # to connecting per query; it still works, just slower.
+        if not sc.Open():
+            statsd.incr('sphinx.pool.open_failed')
+        return sc
+
+    def _is_healthy(self, sc):
+        """
+        A connection is reusable if its last command didn't fail, and if
+        searchd hasn't hung up on it (e.g. because it restarted): searchd
+        never sends anything unasked, so an idle connection only becomes
+        readable once it is closed.
+        """
+        if sc.GetLastError():
+            return False
+        sock = getattr(sc, '_socket', None)
+        if sock is None:  # Not persistent, connects per query.
+            return True
+        try:
+            return not select.select([sock], [], [], 0)[0]
+        except (select.error, socket.error, ValueError):
+            return False
+
+    def _reset(self, sc):
+        """Drop any per-query state left on a reused client."""
+        sc.ResetFilters()
+        sc.ResetGroupBy()
+        sc.SetSelect('*')
+        sc.SetLimits(0, 20)
+        sc.SetSortMode(sphinx.SPH_SORT_RELEVANCE)
+        sc._reqs = []
+        sc._error = ''
+        sc._warning = ''
+
+    def checkout(self):
+        start = time.time()
+        sc = None
+        try:
+            sc = self._idle.get_nowait()
+        except Queue.Empty:
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    sc = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                try:
+                    sc = self._idle.get(timeout=self.timeout)
+                except Queue.Empty:
+                    statsd.incr('sphinx.pool.exhausted')
+                    raise SearchError(_('No search connection available.'))
+
+        if not self._is_healthy(sc):
+            statsd.incr('sphinx.pool.reconnect')
+            self._close(sc)
+            try:
+                sc = self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        self._reset(sc)
+        statsd.timing('sphinx.pool.wait', int((time.time() - start) * 1000))
+        statsd.gauge('sphinx.pool.idle', self._idle.qsize())
+        return sc
+
+    def checkin(self, sc):
+        self._idle.put(sc)
+        statsd.gauge('sphinx.pool.idle', self._idle.qsize())
+
+    def discard(self, sc):
+        """Throw away a connection that is in an unknown state."""
+        self._close(sc)
+        with self._lock:
+            self._created -= 1
+
+    def _close(self, sc):
+        try:
+            sc.Close()
+        except Exception:
+            pass
 
-    def __init__(self):
-        self.sphinx = sphinx.SphinxClient()
-        self.sphinx.SetMatchMode(sphinx.SPH_MATCH_BOOLEAN)
 
-        if os.environ.get('DJANGO_ENVIRONMENT') == 'test':
-            self.sphinx.SetServer(settings.SPHINX_HOST,
-                                  settings.TEST_SPHINX_PORT)
-        else:  # pragma: nocover
-            self.sphinx.SetServer(settings.SPHINX_HOST, settings.SPHINX_PORT)
+_pool = None
+_thread_pool = None
+_pool_lock = threading.Lock()
 
+
+def get_pool():
+    """Returns the process-wide ConnectionPool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def get_thread_pool():
+    """Returns the process-wide worker threads for parallel meta queries."""
+    global _thread_pool
+    if _thread_pool is None:
+        with _pool_lock:
+            if _thread_pool is None:
+                _thread_pool = ThreadPool(settings.SEARCH_META_THREADS)
+    return _thread_pool
+
+
+class Client(object):
+    # Whether to look up and store results in the search result cache.
+    use_cache = True
+
+    def __init__(self, refresh=False, ahead=0):
+        # Recompute (and recache) results even if they are cached and fresh.
+        self.refresh = refresh
+        # Recompute cached results that go stale within ``ahead`` seconds,
+        # c.f. the warm_search_cache cron.
+        self.ahead = ahead
+        self.sphinx = None
         self.index = 'opinions'
         self.meta = {}
         self.queries = {}
@@ -126,7 +527,7 @@ class Client(object):
         self.meta_filters = {}
         self.total_found = 0
 
-    def add_meta_query(self, field, term):
+    def add_meta_query(self, field, term, attr=None):
         """Adds a 'meta' query to the client, this is an aggregate of some
         field that we can use to populate filters.
 
@@ -134,8 +535,11 @@ class Client(object):
 
         E.g. if we can add back category filters to see what tags exist in
         that data set.
+
+        ``attr`` is the attribute to group by, if it isn't ``field`` itself.
         """
         orig_field = field
+        field = attr or field
 
         if '__' in field:
             (field, method, over) = field.split('__')
@@ -170,6 +574,8 @@ class Client(object):
                                                                 **kwargs)
         if 'device' in metas:
             self.meta['device'] = self._device_meta(results, **kwargs)
+        if 'version' in metas:
+            self.meta['version'] = self._version_meta(results, **kwargs)
         if 'day_sentiment' in metas:
             self.meta['day_sentiment'] = self._day_sentiment(results,
                                                                  **kwargs)
@@ -181,14 +587,194 @@ class Client(object):
         self.sphinx.SetFilter(field, values)
 
     def query(self, term, limit=20, offset=0, **kwargs):
-        """Submits formatted query, retrieves ids, returns Opinions."""
-        sc = self.sphinx
+        """
+        Submits formatted query, retrieves ids, returns Opinions.
 
+        Pass ``after=(created, id)`` (c.f. ``decode_cursor``) instead of an
+        offset to get the page of results following that opinion.
+        """
         term = sanitize_query(term)
 
-        # Extract and apply various filters.
-        (includes, ranges, metas) = extract_filters(kwargs)
+        # Extract various filters.
+        filters = extract_filters(kwargs)
+
+        # Look for cached results first; only go to searchd for the rest.
+        meta = list(kwargs.get('meta', []))
+        keys = {}
+        for field in meta:
+            extra = {}
+            if field == 'day_sentiment':
+                extra['attr'] = sentiment_attr(kwargs)
+            keys[field] = query_cache_key(term, filters, field, **extra)
+        keys['primary'] = query_cache_key(term, filters, 'primary',
+                                          limit=limit, offset=offset,
+                                          after=kwargs.get('after'))
+        hits, refreshing = self._cached(keys)
+
+        for field in meta:
+            if field in hits:
+                self.meta[field] = hits[field]
+        missing = [field for field in meta if field not in hits]
+        fresh = {}
+
+        # Without a search term, facets only depend on the filters, so we
+        # can count them from the precomputed rollups.
+        if not term and settings.SEARCH_ROLLUPS:
+            where = rollup_filters(kwargs, filters)
+            rolled = [field for field in missing if field in ROLLUP_METAS]
+            # Only months start at local midnight, the other sentiment
+            # buckets are UTC based.
+            if sentiment_attr(kwargs) != 'month_sentiment':
+                rolled = [field for field in rolled
+                          if field != 'day_sentiment']
+            if rolled and where is not None:
+                for field in rolled:
+                    self.meta[field] = self._rollup_meta(field, where,
+                                                         kwargs)
+                    fresh[keys[field]] = self.meta[field]
+                missing = [field for field in missing if field not in rolled]
+
+        need_primary = 'primary' not in hits
+        if need_primary or missing:
+            if settings.SEARCH_PARALLEL_METAS and missing:
+                run = self._run_parallel
+            else:
+                run = self._run
+            primary = run(term, filters, limit, offset, missing, kwargs,
+                          primary=need_primary)
+
+        if need_primary:
+            fresh[keys['primary']] = primary
+        else:
+            primary = hits['primary']
+
+        # Don't cache facets that were unavailable this time around.
+        fresh.update((keys[field], self.meta[field]) for field in missing
+                     if self.meta.get(field) is not None)
+
+        if fresh and self.use_cache:
+            now = time.time()
+            generation = index_generation()
+            cache.set_many(dict(
+                (key, (generation, now + settings.SEARCH_CACHE_TIMEOUT, value))
+                for key, value in fresh.items()),
+                settings.SEARCH_CACHE_TIMEOUT + settings.SEARCH_CACHE_GRACE)
+        if refreshing:
+            cache.delete_many(refreshing)
+
+        self.total_found = primary['total_found']
+        if primary['has_total']:
+            return self.get_result_set(term, primary['ids'], offset, limit,
+                                       primary.get('found'))
+        else:
+            return []
+
+    def _cached(self, keys):
+        """
+        Looks up the cached parts of a search, given their cache ``keys``.
+        Returns the usable ones, and the refresh locks taken for stale ones.
+
+        Results computed before the last index rotation or more than
+        SEARCH_CACHE_TIMEOUT seconds ago are stale.  Stale results are kept
+        for another SEARCH_CACHE_GRACE seconds: the first search to find
+        one recomputes it while the others keep using the stale copy.
+        """
+        if self.refresh or not self.use_cache:
+            return {}, []
+
+        cached = cache.get_many(keys.values())
+        generation = index_generation()
+        now = time.time() + self.ahead
+        hits = {}
+        refreshing = []
+        for field, key in keys.items():
+            if key not in cached:
+                continue
+            (computed_in, fresh_until, value) = cached[key]
+            if computed_in != generation or fresh_until < now:
+                lock = key + ':refresh'
+                if cache.add(lock, 1, settings.SEARCH_CACHE_GRACE):
+                    refreshing.append(lock)
+                    continue
+                statsd.incr('search.query_cache.stale')
+            hits[field] = value
+
+        statsd.incr('search.query_cache.hits', len(hits))
+        statsd.incr('search.query_cache.misses', len(keys) - len(hits))
+        return hits, refreshing
+
+    def _run(self, term, filters, limit, offset, meta, kwargs,
+             primary=True):
+        """Runs ``_query`` on a connection checked out of the pool."""
+        pool = get_pool()
+        self.sphinx = pool.checkout()
+        try:
+            result = self._query(term, filters, limit, offset, meta, kwargs,
+                                 primary=primary)
+        except Exception:
+            pool.discard(self.sphinx)
+            raise
+        else:
+            pool.checkin(self.sphinx)
+        finally:
+            self.sphinx = None
+        return result
+
+    def _run_parallel(self, term, filters, limit, offset, meta, kwargs,
+                      primary=True):
+        """
+        Runs the primary query and each of the ``meta`` queries concurrently,
+        on their own connections.  A meta query that fails or isn't done
+        SEARCH_META_TIMEOUT seconds after the queries were sent is left
+        unavailable (None) instead of failing the whole search.
+        """
+        deadline = time.time() + settings.SEARCH_META_TIMEOUT
+        jobs = []
+        for field in meta:
+            client = Client()
+            job = get_thread_pool().apply_async(
+                client._run, (term, filters, limit, offset, [field], kwargs),
+                {'primary': False})
+            jobs.append((field, client, job))
+
+        if primary:
+            primary = self._run(term, filters, limit, offset, [], kwargs)
+        else:
+            primary = None
+
+        for field, client, job in jobs:
+            try:
+                job.get(max(0, deadline - time.time()))
+            except multiprocessing.TimeoutError:
+                statsd.incr('sphinx.errors.meta_timeout')
+                self.meta[field] = None
+            except SearchError:
+                statsd.incr('sphinx.errors.meta')
+                self.meta[field] = None
+            except Exception, e:
+                # E.g. socket errors.
+                statsd.incr('sphinx.errors.meta')
+                log.error('Meta query for %s failed: %r' % (field, e))
+                self.meta[field] = None
+            else:
+                self.meta[field] = client.meta.get(field)
+
+        return primary
+
+    def _query(self, term, filters, limit, offset, meta, kwargs,
+               primary=True):
+        """
+        Runs the primary query (unless ``primary`` is False) and the ``meta``
+        queries against searchd.  Returns the primary query's match ids and
+        counts.
+        """
+        sc = self.sphinx
+        (includes, ranges, metas) = filters
+
+        # Only search the partitions covering the requested date range.
+        self.index = index_partitions(*ranges['created'])
 
+        # Apply various filters.
         for filter, value in includes.iteritems():
             self.add_filter(filter, value)
 
@@ -205,17 +791,37 @@ class Client(object):
             sc.SetFilter('has_url', (1,))
             term = ''.join(parts)
 
-        if 'meta' in kwargs:
-            for meta in kwargs['meta']:
-                self.add_meta_query(meta, term)
-
-        sc.SetLimits(min(SPHINX_HARD_LIMIT - limit, offset), limit)
+        for field in meta:
+            attr = sentiment_attr(kwargs) if field == 'day_sentiment' else None
+            self.add_meta_query(field, term, attr)
+
+        if primary:
+            after = kwargs.get('after')
+            if after:
+                # The cursor's filter leaves only the results after it in
+                # total_found, so count all the matches separately.
+                sc.SetSelect('*')
+                sc.SetLimits(0, 1)
+                sc.AddQuery(term, self.index)
+                self.queries['total'] = self.query_index
+                self.query_index += 1
+
+                # Keyset pagination: only results older than the cursor, so
+                # searchd never has to sort past the requested page.
+                (created, id) = after
+                sc.SetSelect('*, IF(created < %d OR (created = %d AND '
+                             '@id < %d), 1, 0) AS before_cursor' %
+                             (created, created, id))
+                sc.SetFilter('before_cursor', (1,))
+                sc.SetLimits(0, limit)
+            else:
+                sc.SetLimits(min(SPHINX_HARD_LIMIT - limit, offset), limit)
 
-        # Always sort in reverse chronological order.
-        sc.SetSortMode(sphinx.SPH_SORT_EXTENDED, 'created DESC')
-        sc.AddQuery(term, self.index)
-        self.queries['primary'] = self.query_index
-        self.query_index += 1
+            # Always sort in reverse chronological order.
+            sc.SetSortMode(sphinx.SPH_SORT_EXTENDED, 'created DESC, @id DESC')
+            sc.AddQuery(term, self.index)
+            self.queries['primary'] = self.query_index
+            self.query_index += 1
         try:
             results = sc.RunQueries()
         except socket.timeout:
@@ -229,26 +835,32 @@ class Client(object):
         if sc.GetLastError():
             raise SearchError(sc.GetLastError())
 
-        result = results[self.queries['primary']]
-        self.total_found = result.get('total_found', 0) if result else 0
+        for result in results:
+            if result['error']:
+                raise SearchError(result['error'])
 
-        if result['error']:
-            raise SearchError(result['error'])
+        self.handle_metas(results, meta, kwargs)
 
-        self.handle_metas(results, kwargs.get('meta', {}), kwargs)
+        if not primary:
+            return None
 
-        if result and 'total' in result:
-            return self.get_result_set(term, result, offset, limit)
-        else:
-            return []
+        result = results[self.queries['primary']]
+        total = results[self.queries.get('total', self.queries['primary'])]
+        return dict(
+            ids=[m['id'] for m in result.get('matches', [])],
+            total_found=total.get('total_found', 0) if total else 0,
+            # The matches from this page's first on.
+            found=result.get('total_found', 0) if result else 0,
+            has_total=bool(result and 'total' in result))
 
     def _day_sentiment(self, results, **kwargs):
         result = results[self.queries['day_sentiment']]
+        attr = sentiment_attr(kwargs)
         pos = []
         neg = []
         ide = []
         for i in result['matches']:
-            day_sentiment = i['attrs']['day_sentiment']
+            day_sentiment = i['attrs'][attr]
             type = day_sentiment % 10
             count = i['attrs']['count']
 
@@ -268,34 +880,89 @@ class Client(object):
 
     def _platform_meta(self, results, **kwargs):
         result = results[self.queries['platform']]
-        t = dict(((crc32(f.short), f.short) for f in PLATFORM_USAGE))
+        t = crc32_names.get('platform')
         return [dict(count=f['attrs']['count'],
                      platform=t.get(f['attrs']['platform']))
                 for f in result['matches']]
 
     def _manufacturer_meta(self, results, **kwargs):
         result = results[self.queries['manufacturer']]
-        t = dict(((crc32(m), m) for m in KNOWN_MANUFACTURERS))
+        t = crc32_names.get('manufacturer')
         return collapsed(result['matches'], t, 'manufacturer')
 
     def _device_meta(self, results, **kwargs):
         result = results[self.queries['device']]
-        t = dict(((crc32(d), d) for d in KNOWN_DEVICES))
+        t = crc32_names.get('device')
         return collapsed(result['matches'], t, 'device')
 
+    def _version_meta(self, results, **kwargs):
+        """Opinion counts per version; versions we don't know of (i.e. not
+        in PRODUCTS) are counted together as None."""
+        result = results[self.queries['version']]
+        t = crc32_names.get('version')
+        return collapsed(result['matches'], t, 'version')
+
     def _locale_meta(self, results, **kwargs):
         result = results[self.queries['locale']]
         if 'matches' in result:
-            t = dict(((crc32(f), f) for f in product_details.languages))
+            t = crc32_names.get('locale')
             return [dict(count=f['attrs']['count'],
                          locale=t.get(f['attrs']['locale']))
                     for f in result['matches']]
 
-    def get_result_set(self, term, result, offset, limit):
+    def _rollup_meta(self, field, filters, kwargs=None):
+        """Counts a meta aggregation from the opinion rollups."""
+        if field == 'day_sentiment':
+            # Add up the days of each month.
+            bucket = sentiment_attr(kwargs or {})[:-len('_sentiment')]
+            counts = defaultdict(int)
+            rows = OpinionRollup.objects.facet(('day', 'type'), **filters)
+            for row in rows:
+                if row['type'] == OPINION_PRAISE.id:
+                    key = 'praise'
+                elif row['type'] == OPINION_IDEA.id:
+                    key = 'idea'
+                else:
+                    key = 'issue'
+                counts[key, bucket_start(row['day'], bucket)] += row['count']
+            data = dict(praise=[], issue=[], idea=[])
+            for (key, start), count in sorted(counts.items()):
+                data[key].append((start, count))
+            return data
+
+        rows = OpinionRollup.objects.facet((field,), **filters)
+        if field == 'type':
+            return list(rows)
+        elif field == 'locale':
+            t = dict((f, f) for f in product_details.languages)
+        elif field == 'platform':
+            t = dict((f.short, f.short) for f in PLATFORM_USAGE)
+        elif field == 'manufacturer':
+            t = dict((m, m) for m in KNOWN_MANUFACTURERS)
+        elif field == 'device':
+            t = dict((d, d) for d in KNOWN_DEVICES)
+        elif field == 'version':
+            t = dict((v, v) for v in _versions())
+
+        if field in ('manufacturer', 'device', 'version'):
+            return collapsed([dict(attrs=row) for row in rows], t, field)
+        return [{'count': row['count'], field: t.get(row[field])}
+                for row in rows]
+
+    def fetch_opinions(self, opinion_ids):
+        """Opinions with the given ids, in that order."""
+        return Opinion.objects.get_many_cached(opinion_ids)
+
+    def get_result_set(self, term, opinion_ids, offset, limit, found=None):
         # Return results as a ResultSet of opinions
-        opinion_ids = [m['id'] for m in result['matches']]
-        opinions = manual_order(Opinion.objects.all(), opinion_ids)
-        return ResultSet(opinions, self.total_found, offset)
+        opinions = self.fetch_opinions(opinion_ids)
+        rs = ResultSet(opinions, self.total_found, offset)
+        if found is None:
+            found = self.total_found
+        if (len(opinion_ids) == limit and opinions and
+            offset + limit < found):
+            rs.next_cursor = encode_cursor(opinions[-1])
+        return rs
 
 
 class ResultSet(object):
@@ -307,6 +974,8 @@ class ResultSet(object):
         self.queryset = queryset
         self.total = total
         self.offset = offset
+        # Cursor for the page after this one, if there might be one.
+        self.next_cursor = None
 
     def __len__(self):
         return self.total
@@ -1,12 +1,48 @@
 import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import signals
+from django.utils import translation
+from django.utils.functional import lazy
+
+from tower import ugettext as _
 
 from input import PRODUCT_USAGE
-from search.forms import VERSION_CHOICES
+from feedback.models import VersionCount
+
+VERSIONS_CHANGED_KEY = settings.CACHE_PREFIX + 'versions:changed'
+_prod_versions = {}
+
+
+def prod_versions_json():
+    """
+    The active versions of each product, as search form choices in JSON.
+    Memoized per language until VersionCount changes (in any process).
+    """
+    changed = cache.get(VERSIONS_CHANGED_KEY)
+    if _prod_versions.get('changed') != changed:
+        _prod_versions.clear()
+        _prod_versions['changed'] = changed
+
+    lang = translation.get_language()
+    if lang not in _prod_versions:
+        versions = VersionCount.objects.filter(active=1)
+        _prod_versions[lang] = json.dumps(dict(
+            (p.short, [('--', _(u'-- all --', 'version_choice'))] +
+                      [(v.version, v.version) for v in versions
+                       if v.product == p.id])
+            for p in PRODUCT_USAGE))
+    return _prod_versions[lang]
+
+
+def versions_changed(sender, **kwargs):
+    cache.set(VERSIONS_CHANGED_KEY, time.time(), 60 * 60 * 24 * 30)
+signals.post_save.connect(versions_changed, sender=VersionCount)
+signals.post_delete.connect(versions_changed, sender=VersionCount)
 
 
 def product_versions(request):
-    return {
-        'PROD_VERSIONS_JSON': json.dumps(dict(
-            [(p.short, [(v[0], unicode(v[1])) for v in
-             VERSION_CHOICES[p]]) for p in PRODUCT_USAGE]))
-    }
+    # Only built when a template uses it.
+    return {'PROD_VERSIONS_JSON': lazy(prod_versions_json, str)()}
@@ -1,3 +1,12 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, Max
+from django.http import HttpRequest, QueryDict
+
 import commonware.log
 import cronjobs
 from celery.messaging import establish_connection
@@ -6,9 +15,16 @@ from celeryutils import chunked
 import input
 from feedback.models import Opinion
 from search import tasks
+from search.client import (Client, SearchError, bump_index_generation,
+                           partition_name, time_as_int)
+from search.models import OpinionRollup, SphinxCounter, sphinx_locale
+from search.utils import hot_queries, run_indexer
 
 log = commonware.log.getLogger('i.cron')
 
+INDEXER_LOCK = settings.CACHE_PREFIX + 'search:indexer_lock'
+INDEXER_LOCK_TIMEOUT = 60 * 60
+
 
 @cronjobs.register
 def index_all():
@@ -22,3 +38,166 @@ def index_all():
     with establish_connection() as conn:
         for chunk in chunked(ids, 1000):
             tasks.add_to_index.apply_async(args=[chunk], connection=conn)
+
+
+@cronjobs.register
+def index_rotated():
+    """
+    Invalidates cached search results.  Run this after the sphinx indexer
+    rotated the opinions index.
+    """
+    bump_index_generation()
+
+
+@cronjobs.register
+def index_delta():
+    """
+    Rebuilds the delta index with the opinions not merged into the monthly
+    partitions yet, so new feedback becomes searchable.  Run every minute.
+    """
+    if not cache.add(INDEXER_LOCK, 1, INDEXER_LOCK_TIMEOUT):
+        log.info('Indexer is busy, skipping delta.')
+        return
+    try:
+        # Leave the delta, and the cached search results, alone unless
+        # there is new feedback.
+        latest = Opinion.objects.no_cache().aggregate(id=Max('id'))['id']
+        delta = SphinxCounter.objects.get(pk=SphinxCounter.DELTA)
+        if (latest or 0) == delta.max_doc_id:
+            return
+
+        if run_indexer('--rotate', 'opinions_delta'):
+            bump_index_generation()
+        else:
+            log.error('Building the delta index failed.')
+    finally:
+        cache.delete(INDEXER_LOCK)
+
+
+@cronjobs.register
+def merge_delta():
+    """
+    Merges the delta index into the partitions of the months its opinions
+    were created in and starts a new, empty delta.  Also builds next month's
+    partition ahead of time.  Run nightly, after midnight.
+    """
+    if not cache.add(INDEXER_LOCK, 1, INDEXER_LOCK_TIMEOUT):
+        log.error('Indexer is busy, not merging the delta.')
+        return
+    try:
+        _merge_delta()
+        _build_next_partition()
+    finally:
+        cache.delete(INDEXER_LOCK)
+
+
+def _merge_delta():
+    main = SphinxCounter.objects.get(pk=SphinxCounter.MAIN)
+    delta = SphinxCounter.objects.get(pk=SphinxCounter.DELTA)
+    months = (Opinion.objects.no_cache()
+              .filter(id__gt=main.max_doc_id, id__lte=delta.max_doc_id)
+              .dates('created', 'month'))
+    names = [partition_name(d.year, d.month) for d in months]
+    if not names:
+        log.info('The delta is empty, nothing to merge.')
+        return
+
+    counter = SphinxCounter.objects.filter(pk=SphinxCounter.MAIN)
+    if len(names) == 1:
+        # Merging the small delta is much cheaper than rebuilding the month.
+        if not run_indexer('--rotate', '--merge', names[0],
+                           'opinions_delta'):
+            log.error('Merging the delta into %s failed.' % names[0])
+            return
+        counter.update(max_doc_id=delta.max_doc_id)
+    else:
+        # The delta spans several months, but merging can't split it up:
+        # rebuild each month with its opinions from the delta instead.
+        counter.update(max_doc_id=delta.max_doc_id)
+        for name in names:
+            if not run_indexer('--rotate', name):
+                log.error('Rebuilding %s failed.' % name)
+                # Keep the opinions in the delta and try again tomorrow.
+                # Until then, the months rebuilt so far have them, too.
+                counter.update(max_doc_id=main.max_doc_id)
+                return
+
+    # Everything that was in the delta is in the partitions now.
+    run_indexer('--rotate', 'opinions_delta')
+    bump_index_generation()
+    log.info('Merged the delta into %s.' % ', '.join(names))
+
+
+def _build_next_partition():
+    """
+    Builds next month's (empty) partition, so searchd serves it before any
+    query is sent to it.  Rotating makes searchd re-read its config, which
+    lists next month's partition (c.f. sphinx.conf).
+    """
+    if settings.SPHINX_PARTITION_END:
+        return
+    today = date.today()
+    name = (partition_name(today.year + 1, 1) if today.month == 12 else
+            partition_name(today.year, today.month + 1))
+    if not run_indexer('--rotate', name):
+        log.error('Building the partition %s failed.' % name)
+
+
+ROLLUP_KEYS = ('day', 'product', 'version', 'platform', 'locale', '_type',
+               'manufacturer', 'device')
+
+
+@cronjobs.register
+@transaction.commit_on_success
+def update_rollups(days=2):
+    """
+    Recounts the opinion rollups of the last ``days`` days.  Run this every
+    few minutes; run it once with a large number of days to backfill.
+    """
+    since = time_as_int(date.today() - timedelta(days=int(days) - 1))
+
+    # Days start at local midnight, like the date filters.
+    groups = (Opinion.objects.no_cache()
+              .filter(_type__in=[i.id for i in input.OPINION_TYPES_USAGE],
+                      created__gte=datetime.fromtimestamp(since))
+              .extra(select={'day': 'UNIX_TIMESTAMP(DATE(created))'})
+              .values(*ROLLUP_KEYS).annotate(count=Count('id')).order_by())
+
+    counts = defaultdict(int)
+    for group in groups:
+        if group['day'] < since:
+            continue
+        group['locale'] = sphinx_locale(group['locale'])
+        counts[tuple(group[k] for k in ROLLUP_KEYS)] += group['count']
+
+    OpinionRollup.objects.filter(day__gte=since).delete()
+    cursor = connection.cursor()
+    cursor.executemany(
+        'INSERT INTO opinion_rollup (day, product, version, platform, '
+        'locale, type, manufacturer, device, count) '
+        'VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)',
+        [key + (count,) for key, count in counts.iteritems()])
+    log.info('Rolled up %d groups since %s.' % (len(counts), since))
+
+
+@cronjobs.register
+def warm_search_cache():
+    """
+    Recomputes the cached results of the most frequent recent searches
+    before they go stale, so that rendering their pages never waits for
+    searchd.  Results that stay fresh until the next run are left alone.
+    Run every minute, right after index_delta.
+    """
+    from search.views import DASHBOARD_META, _get_results
+
+    queries = hot_queries(settings.SEARCH_WARM_QUERIES)
+    for query_string in queries:
+        request = HttpRequest()
+        request.GET = QueryDict(query_string)
+        request.default_prod = input.FIREFOX  # Unused, the product is set.
+        try:
+            _get_results(request, meta=DASHBOARD_META,
+                         client=Client(ahead=settings.SEARCH_WARM_AHEAD))
+        except SearchError, e:
+            log.warning('Warming search %r failed: %s' % (query_string, e))
+    log.info('Warmed %d searches.' % len(queries))
@@ -72,7 +72,12 @@ class ReporterSearchForm(forms.Form):
     date_end = forms.DateField(required=False, widget=DateInput(
         # L10n: This indicates the second part of a date range.
         attrs={'class': 'datepicker'}), label=_lazy('to'))
+    # Without a date range, search all dates instead of the last
+    # SEARCH_DEFAULT_DAYS.
+    all_dates = forms.BooleanField(widget=forms.HiddenInput, required=False)
     page = forms.IntegerField(widget=forms.HiddenInput, required=False)
+    # Opaque keyset pagination cursor, c.f. search.client.encode_cursor.
+    cursor = forms.CharField(widget=forms.HiddenInput, required=False)
 
     # TODO(davedash): Make this prettier.
     def __init__(self, *args, **kwargs):
@@ -124,8 +129,10 @@ class ReporterSearchForm(forms.Form):
 
     def full_clean(self):
         """
-        Like Django's but we don't delete cleaned_data on error.
+        Like Django's but we don't delete cleaned_data on error.  The names
+        of the fields that had errors end up in ``invalid_fields``.
         """
+        self.invalid_fields = []
         self._errors = ErrorDict()
         if not self.is_bound: # Stop further processing.
             return
@@ -138,6 +145,9 @@ class ReporterSearchForm(forms.Form):
         self._clean_form()
         self._post_clean()
         # Errors are for data-prudes
-        for field in self._errors.keys():
-            self.cleaned_data[field] = ''
+        self.invalid_fields = sorted(self._errors.keys())
+        for field in self.invalid_fields:
+            # clean() fell back to the first page already.
+            if field != 'page':
+                self.cleaned_data[field] = ''
         self._errors = ErrorDict()
@@ -1,12 +1,18 @@
 import datetime
 import json
+import sys
+from UserDict import DictMixin
 from urllib import urlencode
 
 from django.conf import settings
+from django.core.cache import cache
+from django.utils import translation
+from django.utils.hashcompat import md5_constructor
 
 from jingo import register
 import jinja2
 from product_details.version_compare import Version
+from statsd import statsd
 
 import input
 from input.urlresolvers import reverse
@@ -55,12 +61,80 @@ def new_context(context, **kw):
     return c
 
 
+class LayeredContext(DictMixin):
+    """
+    A read-only view of a Jinja ``context`` with the ``overlay`` variables
+    on top.  Unlike ``new_context`` it doesn't copy the context.
+    """
+
+    def __init__(self, context, overlay):
+        self.context = context
+        self.overlay = overlay
+
+    def __getitem__(self, key):
+        if key in self.overlay:
+            return self.overlay[key]
+        return self.context[key]
+
+    def __contains__(self, key):
+        return key in self.overlay or key in self.context
+
+    def keys(self):
+        return list(set(self.overlay).union(self.context.keys()))
+
+
+def layered_context(context, **kw):
+    """Helper adding variables to the existing context, without copying."""
+    return LayeredContext(context, kw)
+
+
 def render_template(template, context):
     """Helper rendering a Jinja template."""
-    t = register.env.get_template(template).render(context)
+    t = register.env.get_template(template)
+    if isinstance(context, LayeredContext):
+        # Template.render would copy the context (twice); share it instead.
+        try:
+            t = jinja2.utils.concat(
+                t.root_render_func(t.new_context(context, shared=True)))
+        except Exception:
+            exc_info = sys.exc_info()
+            t = t.environment.handle_exception(exc_info, True)
+    else:
+        t = t.render(context)
     return jinja2.Markup(t)
 
 
+def fragment_cache_key(template, context, data):
+    """
+    Cache key of a block rendered from ``template`` and its input ``data``.
+    Blocks also depend on the locale and the site's default product.
+    """
+    data = sorted((k, sorted(v.items()) if isinstance(v, dict) else v)
+                  for k, v in data.items())
+    product = getattr(context['request'], 'default_prod', None)
+    key = repr((template, translation.get_language(),
+                getattr(product, 'short', None), data))
+    return '%sfragment:%s' % (settings.CACHE_PREFIX,
+                              md5_constructor(key).hexdigest())
+
+
+def render_cached(template, context, **data):
+    """
+    Like ``render_template``, for blocks that only depend on their input
+    ``data``: unchanged blocks are served pre-rendered from the cache.
+    """
+    key = fragment_cache_key(template, context, data)
+    html = cache.get(key)
+    if html is None:
+        statsd.incr('search.fragment_cache.misses')
+        html = unicode(render_template(template,
+                                       layered_context(context, **data)))
+        cache.set(key, html, settings.FRAGMENT_CACHE_TIMEOUT)
+    else:
+        statsd.incr('search.fragment_cache.hits')
+    return jinja2.Markup(html)
+
+
 @register.function
 @jinja2.contextfunction
 def big_count_block(context, count):
@@ -68,7 +142,7 @@ def big_count_block(context, count):
         tpl = 'search/opinion_count.html'
     else:
         tpl = 'search/mobile/opinion_count.html'
-    return render_template(tpl, new_context(**locals()))
+    return render_cached(tpl, context, count=count)
 
 
 @register.function
@@ -78,7 +152,8 @@ def locales_block(context, locales, total, defaults=None):
         tpl = 'search/locales.html'
     else:
         tpl = 'search/mobile/locales.html'
-    return render_template(tpl, new_context(**locals()))
+    return render_cached(tpl, context, locales=locales,
+                         total=total, defaults=defaults)
 
 
 @register.function
@@ -89,7 +164,7 @@ def message_list(context, opinions, defaults=None, show_notfound=True):
         tpl = 'search/message_list.html'
     else:
         tpl = 'search/mobile/message_list.html'
-    return render_template(tpl, new_context(**locals()))
+    return render_template(tpl, layered_context(**locals()))
 
 
 @register.function
@@ -99,7 +174,8 @@ def platforms_block(context, platforms, total, defaults=None):
         tpl = 'search/platforms.html'
     else:
         tpl = 'search/mobile/platforms.html'
-    return render_template(tpl, new_context(**locals()))
+    return render_cached(tpl, context, platforms=platforms,
+                         total=total, defaults=defaults)
 
 
 @register.function
@@ -109,7 +185,8 @@ def manufacturer_block(context, manufacturers, total, defaults=None):
         tpl = 'search/manufacturers.html'
     else:
         tpl = 'search/mobile/manufacturers.html'
-    return render_template(tpl, new_context(**locals()))
+    return render_cached(tpl, context, manufacturers=manufacturers,
+                         total=total, defaults=defaults)
 
 
 @register.function
@@ -119,7 +196,8 @@ def device_block(context, devices, total, defaults=None):
         tpl = 'search/devices.html'
     else:
         tpl = 'search/mobile/devices.html'
-    return render_template(tpl, new_context(**locals()))
+    return render_cached(tpl, context, devices=devices,
+                         total=total, defaults=defaults)
 
 
 @register.function
@@ -129,7 +207,7 @@ def overview_block(context, sent, defaults=None):
         tpl = 'search/overview.html'
     else:
         tpl = 'search/mobile/overview.html'
-    return render_template(tpl, new_context(**locals()))
+    return render_cached(tpl, context, sent=sent, defaults=defaults)
 
 
 @register.function
@@ -143,7 +221,7 @@ def sites_block(context, sites, defaults=None):
         tpl = 'search/sites.html'
     else:
         tpl = 'search/mobile/sites.html'
-    return render_template(tpl, new_context(**locals()))
+    return render_template(tpl, layered_context(**locals()))
 
 
 @register.function
@@ -154,7 +232,7 @@ def themes_block(context, themes, defaults=None):
         tpl = 'search/themes.html'
     else:
         tpl = 'search/mobile/themes.html'
-    return render_template(tpl, new_context(**locals()))
+    return render_template(tpl, layered_context(**locals()))
 
 
 @register.inclusion_tag('search/products.html')
@@ -189,7 +267,7 @@ def when_block(context, form, defaults=None, selected=None):
         tpl = 'search/when.html'
     else:
         tpl = 'search/mobile/when.html'
-    return render_template(tpl, new_context(**locals()))
+    return render_template(tpl, layered_context(**locals()))
 
 
 @register.function
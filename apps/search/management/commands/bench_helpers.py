@@ -0,0 +1,88 @@
+import time
+from optparse import make_option
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.http import HttpRequest
+from django.template.context import get_standard_processors
+from django.utils import translation
+
+from jingo import register
+from product_details import product_details
+
+from input import (FIREFOX, KNOWN_DEVICES, KNOWN_MANUFACTURERS,
+                   PLATFORM_USAGE)
+from search.helpers import layered_context, new_context, render_template
+
+
+def sidebar_blocks():
+    """(template, data) of the dashboard sidebar blocks, with made up data."""
+    total = 1000
+    return [
+        ('search/platforms.html', dict(
+            platforms=[dict(platform=p.short, count=100 - i)
+                       for i, p in enumerate(PLATFORM_USAGE)],
+            total=total, defaults={})),
+        ('search/locales.html', dict(
+            locales=[dict(locale=l, count=10) for l in
+                     sorted(product_details.languages)[:30]],
+            total=total, defaults={})),
+        ('search/manufacturers.html', dict(
+            manufacturers=[dict(manufacturer=m, count=5)
+                           for m in KNOWN_MANUFACTURERS],
+            total=total, defaults={})),
+        ('search/devices.html', dict(
+            devices=[dict(device=d, count=3) for d in KNOWN_DEVICES[:15]],
+            total=total, defaults={})),
+        ('search/overview.html', dict(
+            sent=dict(happy=500, sad=300, ideas=200, total=total,
+                      sentiment='happy'),
+            defaults={})),
+        ('search/opinion_count.html', dict(count=total)),
+    ]
+
+
+class Command(BaseCommand):
+    """
+    Times rendering the dashboard sidebar blocks on top of a copy of the
+    page's template context (``new_context``) and on top of the context
+    itself (``layered_context``).
+    """
+    help = 'Time rendering the dashboard sidebar blocks.'
+
+    option_list = BaseCommand.option_list + (
+        make_option('-n',
+                    action='store',
+                    type='int',
+                    dest='number',
+                    default=500,
+                    help='Number of sidebars to render.'),
+    )
+
+    def handle(self, *args, **options):
+        translation.activate('en-US')
+        request = HttpRequest()
+        request.user = AnonymousUser()
+        request.mobile_site = False
+        request.default_prod = FIREFOX
+
+        # The page's context, as the sidebar helpers would get it.
+        data = {'request': request}
+        for processor in get_standard_processors():
+            data.update(processor(request))
+        context = register.env.from_string('').new_context(data)
+
+        blocks = sidebar_blocks()
+        number = options['number']
+        for name, make in (('new_context', new_context),
+                           ('layered_context', layered_context)):
+            for tpl, block in blocks:  # Compile the templates first.
+                render_template(tpl, make(context, **block))
+
+            start = time.time()
+            for i in xrange(number):
+                for tpl, block in blocks:
+                    render_template(tpl, make(context, **block))
+            elapsed = time.time() - start
+            print '%-16s %.3f ms per sidebar' % (name,
+                                                 elapsed / number * 1000)
@@ -0,0 +1,71 @@
+from django.db import models
+from django.db.models import Sum
+
+from input import PRODUCT_IDS
+
+
+# Locales kept intact by the sphinx indexer; all others are shortened to
+# their language part. c.f. configs/sphinx/sphinx.conf
+SPHINX_FULL_LOCALES = ('zh-TW', 'pa-IN', 'ne-NP', 'en-GB', 'bn-IN', 'en-NZ',
+                       'pt-BR', 'nb-NO', 'gu-IN', 'zh-CN', 'tt-RU', 'fur-IT',
+                       'pt-PT', 'nn-NO', 'fy-NL', 'en-CA', 'fj-FJ', 'en-US',
+                       'en-ZA', 'bn-BD', 'sv-SE', 'en-AU', 'hy-AM')
+
+
+def sphinx_locale(locale):
+    """Normalize a locale the same way the sphinx indexer does."""
+    if locale in SPHINX_FULL_LOCALES:
+        return locale
+    return locale.split('-', 1)[0]
+
+
+class OpinionRollupManager(models.Manager):
+    def facet(self, fields, **filters):
+        """
+        Opinion counts grouped by ``fields``, restricted by ``filters``.
+        Returns a list of dicts with the field values and a ``count``.
+        """
+        return (self.filter(**filters).values(*fields)
+                    .annotate(count=Sum('count')).order_by('-count'))
+
+
+class OpinionRollup(models.Model):
+    """Denormalized opinion counts per day and dashboard facet.
+
+    Built from opinions by the ``update_rollups`` cron, so empty-term
+    dashboard views can show their facets without asking searchd.
+    """
+
+    # Start of the day as a unix timestamp.  Days start at local midnight,
+    # like the date filters (c.f. search.client.extract_filters).
+    day = models.PositiveIntegerField(db_index=True)
+    product = models.PositiveSmallIntegerField(
+        choices=((prod, PRODUCT_IDS[prod].pretty) for prod in PRODUCT_IDS))
+    version = models.CharField(max_length=30)
+    platform = models.CharField(max_length=30)
+    locale = models.CharField(max_length=30)
+    type = models.PositiveSmallIntegerField()
+    manufacturer = models.CharField(max_length=255)
+    device = models.CharField(max_length=255)
+    count = models.PositiveIntegerField()
+
+    objects = OpinionRollupManager()
+
+    class Meta:
+        db_table = 'opinion_rollup'
+
+
+class SphinxCounter(models.Model):
+    """Bookkeeping for the main+delta sphinx indexes.
+
+    Counter 1 is the last opinion id merged into the monthly partitions,
+    counter 2 the last opinion id in the delta. c.f. sphinx.conf
+    """
+    MAIN = 1
+    DELTA = 2
+
+    counter_id = models.PositiveIntegerField(primary_key=True)
+    max_doc_id = models.PositiveIntegerField()
+
+    class Meta:
+        db_table = 'sphinx_counter'
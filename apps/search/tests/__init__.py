@@ -27,6 +27,11 @@ class SphinxTestCase(test_utils.TestCase):
             raise SkipTest()
 
         os.environ['DJANGO_ENVIRONMENT'] = 'test'
+        # The test index only has the partitions of the fixtures' months.
+        cls._partitions = (settings.SPHINX_PARTITION_START,
+                           settings.SPHINX_PARTITION_END)
+        settings.SPHINX_PARTITION_START = settings.TEST_SPHINX_PARTITION_START
+        settings.SPHINX_PARTITION_END = settings.TEST_SPHINX_PARTITION_END
 
         if os.path.exists(settings.TEST_SPHINX_CATALOG_PATH):
             shutil.rmtree(settings.TEST_SPHINX_CATALOG_PATH)
@@ -42,4 +47,6 @@ class SphinxTestCase(test_utils.TestCase):
     @classmethod
     def teardown_class(cls):
         stop_sphinx()
+        (settings.SPHINX_PARTITION_START,
+         settings.SPHINX_PARTITION_END) = cls._partitions
         super(SphinxTestCase, cls).teardown_class()
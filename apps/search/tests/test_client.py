@@ -1,12 +1,22 @@
 import datetime
 import socket
+import time
+
+from django.conf import settings
+from django.core.cache import cache
 
 from mock import patch
 from nose.tools import eq_
 
 import input
 from feedback.models import Opinion
-from search.client import Client, SearchError, extract_filters
+from input.utils import crc32
+from search.client import (Client, ConnectionPool, Crc32Registry, SearchError,
+                           bucket_start, bump_index_generation, crc32_names,
+                           decode_cursor, encode_cursor, extract_filters,
+                           index_generation, index_partitions,
+                           query_cache_key, rollup_filters, time_as_int)
+from search.models import sphinx_locale
 from search.tests import SphinxTestCase
 
 query = lambda x='', **kwargs: Client().query(x, **kwargs)
@@ -62,6 +72,47 @@ class SearchTest(SphinxTestCase):
         eq_(num_results(version='3.6.3', date_start=start), 11)
         eq_(num_results(version='3.6.4', date_start=start), 16)
 
+    def test_version_meta(self):
+        """Per-version counts come back with the query; unknown versions are
+        counted together."""
+        start = datetime.datetime(2010, 5, 27)
+        known = {crc32('3.6.3'): '3.6.3', crc32('3.6.4'): '3.6.4'}
+        with patch.dict(crc32_names._maps, version=known):
+            c = Client()
+            c.query('', meta=('version',), date_start=start)
+        eq_(c.meta['version'], [dict(version='3.6.4', count=16),
+                                dict(version='3.6.3', count=11),
+                                dict(version=None, count=4)])
+
+    def test_sentiment_buckets(self):
+        """Sentiment over time adds up the same in any bucket size."""
+        start = datetime.datetime(2010, 5, 27)
+        totals = {}
+        for bucket in ('hour', 'day', 'week', 'month'):
+            c = Client()
+            c.query('', meta=('day_sentiment',), date_start=start,
+                    bucket=bucket)
+            points = sum(c.meta['day_sentiment'].values(), [])
+            for (timestamp, count) in points:
+                eq_(bucket_start(timestamp, bucket), timestamp)
+            totals[bucket] = sum(count for (timestamp, count) in points)
+        eq_(set(totals.values()), set([31]))
+
+    def test_stale_results(self):
+        """Stale results are used while another search recomputes them."""
+        start = datetime.datetime(2010, 5, 27)
+        eq_(num_results(date_start=start), 31)
+        bump_index_generation()
+        with patch('search.client.cache.add', lambda *args: False):
+            with patch.object(Client, '_run') as run:
+                eq_(num_results(date_start=start), 31)
+                assert not run.called
+
+        # The first search to find them stale recomputes them.
+        with patch.object(Client, '_run') as run:
+            run.return_value = dict(ids=[], total_found=0, has_total=True)
+            eq_(num_results(date_start=start), 0)
+
     @patch('search.client.sphinx.SphinxClient.GetLastError')
     def test_getlasterror(self, sphinx):
         sphinx = lambda: True
@@ -117,9 +168,230 @@ def test_date_filter_timezone():
     eq_(ranges['created'][1], 1265011200)
 
 
+def test_default_date_range():
+    """Without dates, searches cover SEARCH_DEFAULT_DAYS or all dates."""
+    today = datetime.date.today()
+    tomorrow = time_as_int(today + datetime.timedelta(days=1))
+    ago = today - datetime.timedelta(days=settings.SEARCH_DEFAULT_DAYS)
+    _, ranges, _ = extract_filters({})
+    eq_(ranges['created'], (time_as_int(ago), tomorrow))
+    # Only the partitions of those days are searched.
+    eq_(index_partitions(*ranges['created']).split()[0],
+        'opinions_%04d_%02d' % (ago.year, ago.month))
+
+    _, ranges, _ = extract_filters(dict(all_dates=True))
+    eq_(ranges['created'], (time_as_int(datetime.date(2010, 4, 1)), tomorrow))
+
+
 def test_extract_filters_unknown():
     """
     Test that we return the proper value of unknown that sphinx is expecting.
     """
     _, _, metas = extract_filters(dict(platform='unknown'))
     eq_(metas['platform'], 0)
+
+
+def test_query_cache_key_normalized():
+    """Equivalent searches share a cache key, different ones don't."""
+    filters = lambda **kw: extract_filters(dict(
+        date_start=datetime.date(2010, 1, 1), **kw))
+    key = lambda term, f, part='primary': query_cache_key(term, f, part)
+
+    eq_(key('crash', filters(locale='de', platform='mac')),
+        key('crash', filters(platform='mac', locale='de')))
+    # Terms can be case sensitive: only 'url:*' filters by URL.
+    assert key('url:*', filters()) != key('URL:*', filters())
+    assert (key('crash', filters(locale='de')) !=
+            key('crash', filters(locale='fr')))
+    assert (key('crash', filters(), 'locale') !=
+            key('crash', filters(), 'platform'))
+
+
+def test_crc32_registry():
+    """Reverse maps are built lazily, can be rebuilt and report collisions."""
+    names = ['mac', 'win7']
+    registry = Crc32Registry()
+    registry.register('platform', lambda: names)
+    eq_(registry.get('platform'), {crc32('mac'): 'mac', crc32('win7'): 'win7'})
+
+    names.append('linux')
+    assert crc32('linux') not in registry.get('platform')
+    registry.invalidate('platform')
+    eq_(registry.get('platform')[crc32('linux')], 'linux')
+
+    # These two famously share a crc32.
+    registry.register('device', lambda: ['plumless', 'buckeroo'])
+    eq_(registry.get('device'), {crc32('plumless'): 'plumless'})
+    eq_(registry.collisions['device'], [('plumless', 'buckeroo')])
+
+
+def test_bucket_start():
+    ts = 1276979445  # 2010-06-19 20:30:45 UTC, a Saturday.
+    eq_(bucket_start(ts, 'hour'), 1276977600)
+    eq_(bucket_start(ts, 'day'), 1276905600)
+    eq_(bucket_start(ts, 'week'), 1276473600)  # Monday, June 14th.
+    # Months start at local midnight.
+    eq_(bucket_start(ts, 'month'), time_as_int(datetime.date(2010, 6, 1)))
+    eq_(bucket_start(time_as_int(datetime.date(2010, 6, 1)), 'month'),
+        time_as_int(datetime.date(2010, 6, 1)))
+
+
+def test_cursor():
+    """Cursors round-trip, and garbage doesn't decode."""
+    o = Opinion(id=123, created=datetime.datetime(2010, 5, 27, 12, 0))
+    eq_(decode_cursor(encode_cursor(o)),
+        (time_as_int(o.created), 123))
+    eq_(decode_cursor('bogus'), None)
+    eq_(decode_cursor(u'\xfc'), None)
+    eq_(decode_cursor(''), None)
+
+
+def test_index_partitions():
+    """Queries only go to the partitions covering their date range."""
+    eq_(index_partitions(time_as_int(datetime.date(2010, 5, 27)),
+                         time_as_int(datetime.date(2010, 7, 1))),
+        'opinions_2010_05 opinions_2010_06 opinions_delta')
+
+    # Nothing before the first partition.
+    eq_(index_partitions(0, time_as_int(datetime.date(2010, 4, 2))),
+        'opinions_2010_04 opinions_delta')
+
+    # Queries up to today include the current month.
+    today = datetime.date.today()
+    tomorrow = today + datetime.timedelta(days=1)
+    eq_(index_partitions(time_as_int(today), time_as_int(tomorrow)),
+        'opinions_%04d_%02d opinions_delta' % (today.year, today.month))
+
+
+@patch.object(settings._wrapped, 'SPHINX_PARTITION_END', (2010, 6))
+def test_index_partitions_end():
+    """Queries never go to partitions after the last one."""
+    eq_(index_partitions(time_as_int(datetime.date(2010, 6, 1)),
+                         time_as_int(datetime.date(2010, 9, 1))),
+        'opinions_2010_06 opinions_delta')
+    eq_(index_partitions(time_as_int(datetime.date(2010, 8, 1)),
+                         time_as_int(datetime.date.today())),
+        'opinions_delta')
+
+
+def test_rollup_filters():
+    """Rollup filters mirror the filters sent to searchd."""
+    kwargs = dict(product=1, version='4.0', platform='unknown', locale='de',
+                  date_start=datetime.date(2010, 1, 1),
+                  date_end=datetime.date(2010, 1, 31))
+    where = rollup_filters(kwargs, extract_filters(kwargs))
+    eq_(where['product'], 1)
+    eq_(where['version'], '4.0')
+    eq_(where['platform'], '')
+    eq_(where['locale'], 'de')
+    # Exactly the range searchd gets, in whole local days.
+    eq_(where['day__gte'], 1262332800)  # 8:00 UTC on 1/1/2010
+    eq_(where['day__lt'], 1265011200)
+
+    # Rollups can't count part of a day.
+    kwargs['date_start'] = datetime.datetime(2010, 1, 1, 12, 0)
+    eq_(rollup_filters(kwargs, extract_filters(kwargs)), None)
+    kwargs['date_start'] = datetime.date(2010, 1, 1)
+    kwargs['utc'] = True
+    eq_(rollup_filters(kwargs, extract_filters(kwargs)), None)
+
+
+def test_sphinx_locale():
+    eq_(sphinx_locale('en-US'), 'en-US')
+    eq_(sphinx_locale('de-AT'), 'de')
+    eq_(sphinx_locale(''), '')
+
+
+@patch('search.client.sphinx.SphinxClient.Open')
+def test_pool_reuses_connections(open_):
+    """A checked in connection is handed out again instead of a new one."""
+    open_.return_value = True
+    pool = ConnectionPool(size=2, timeout=0.01)
+    sc = pool.checkout()
+    pool.checkin(sc)
+    assert pool.checkout() is sc
+    eq_(open_.call_count, 1)
+
+
+@patch('search.client.sphinx.SphinxClient.Open')
+def test_pool_exhausted(open_):
+    """Waiting too long for a connection raises a SearchError."""
+    open_.return_value = True
+    pool = ConnectionPool(size=1, timeout=0.01)
+    pool.checkout()
+    try:
+        pool.checkout()
+    except SearchError:
+        pass
+    else:
+        assert False, 'Expected SearchError.'
+
+
+@patch('search.client.sphinx.SphinxClient.Open')
+def test_pool_reconnects_closed(open_):
+    """Connections searchd hung up on are replaced on checkout."""
+    open_.return_value = True
+    pool = ConnectionPool(size=1, timeout=0.01)
+    sc = pool.checkout()
+    ours, theirs = socket.socketpair()
+    sc._socket = ours
+    pool.checkin(sc)
+    theirs.close()  # searchd restarted.
+    assert pool.checkout() is not sc
+    eq_(open_.call_count, 2)
+    ours.close()
+
+
+@patch('search.client.sphinx.SphinxClient.Open')
+def test_pool_failed_reconnect(open_):
+    """A failed reconnect doesn't use up the pool's capacity."""
+    open_.return_value = True
+    pool = ConnectionPool(size=1, timeout=0.01)
+    sc = pool.checkout()
+    sc._error = 'broken'
+    pool.checkin(sc)
+    open_.side_effect = socket.error
+    try:
+        pool.checkout()
+    except socket.error:
+        pass
+    else:
+        assert False, 'Expected socket.error.'
+    eq_(pool._created, 0)
+
+
+@patch.object(settings._wrapped, 'SEARCH_META_TIMEOUT', 0.2)
+def test_run_parallel():
+    """Meta queries get SEARCH_META_TIMEOUT from the start, and failing
+    ones are left unavailable."""
+    def run(self, term, filters, limit, offset, meta, kwargs, primary=True):
+        if primary:
+            time.sleep(0.3)
+            return 'primary'
+        field = meta[0]
+        if field == 'locale':
+            raise socket.error('Connection reset by peer')
+        elif field == 'platform':
+            time.sleep(1)
+        self.meta[field] = field
+
+    with patch.object(Client, '_run', run):
+        client = Client()
+        start = time.time()
+        eq_(client._run_parallel('', None, 20, 0,
+                                 ['type', 'locale', 'platform'], {}),
+            'primary')
+        assert time.time() - start < 0.45
+    eq_(client.meta, {'type': 'type', 'locale': None, 'platform': None})
+
+
+def test_cached_ahead():
+    """Warming only recomputes results going stale soon."""
+    key = settings.CACHE_PREFIX + 'search:test-ahead'
+    cache.delete(key + ':refresh')
+    cache.set(key, (index_generation(), time.time() + 60, 'value'))
+    eq_(Client()._cached({'primary': key}), ({'primary': 'value'}, []))
+    eq_(Client(ahead=120)._cached({'primary': key}),
+        ({}, [key + ':refresh']))
+    cache.delete(key + ':refresh')
+
@@ -0,0 +1,120 @@
+from datetime import date, datetime, time, timedelta
+
+from django.conf import settings
+
+import test_utils
+from mock import patch
+from nose.tools import eq_
+
+import input
+from feedback.models import Opinion
+from search.client import partition_name, time_as_int
+from search.cron import index_delta, merge_delta, update_rollups
+from search.models import OpinionRollup, SphinxCounter
+
+
+def counter(pk):
+    return SphinxCounter.objects.get(pk=pk).max_doc_id
+
+
+class IndexerTestCase(test_utils.TestCase):
+    def setUp(self):
+        SphinxCounter.objects.create(counter_id=SphinxCounter.MAIN,
+                                     max_doc_id=0)
+        SphinxCounter.objects.create(counter_id=SphinxCounter.DELTA,
+                                     max_doc_id=0)
+
+    def opinion(self, created):
+        o = Opinion.objects.create(product=1, description='Delta test')
+        Opinion.objects.filter(pk=o.pk).update(created=created)
+        return o
+
+
+@patch('search.cron.bump_index_generation')
+@patch('search.cron.run_indexer')
+class TestIndexDelta(IndexerTestCase):
+    def test_new_opinions(self, run_indexer, bump):
+        """New feedback is indexed and invalidates cached results."""
+        run_indexer.return_value = True
+        self.opinion(datetime.now())
+        index_delta()
+        run_indexer.assert_called_with('--rotate', 'opinions_delta')
+        eq_(bump.call_count, 1)
+
+    def test_unchanged(self, run_indexer, bump):
+        """Without new feedback, the delta and the cache are left alone."""
+        o = self.opinion(datetime.now())
+        SphinxCounter.objects.filter(pk=SphinxCounter.DELTA).update(
+            max_doc_id=o.id)
+        index_delta()
+        eq_(run_indexer.call_count, 0)
+        eq_(bump.call_count, 0)
+
+
+@patch.object(settings._wrapped, 'SPHINX_PARTITION_END', (2010, 6))
+@patch('search.cron.bump_index_generation')
+@patch('search.cron.run_indexer')
+class TestMergeDelta(IndexerTestCase):
+    def delta(self, *dates):
+        opinions = [self.opinion(d) for d in dates]
+        SphinxCounter.objects.filter(pk=SphinxCounter.DELTA).update(
+            max_doc_id=opinions[-1].id)
+        return opinions[-1].id
+
+    def test_one_month(self, run_indexer, bump):
+        """A delta within one month is merged into that month."""
+        run_indexer.return_value = True
+        last = self.delta(datetime(2010, 5, 30), datetime(2010, 5, 31))
+        merge_delta()
+        eq_(run_indexer.call_args_list[0][0],
+            ('--rotate', '--merge', 'opinions_2010_05', 'opinions_delta'))
+        eq_(counter(SphinxCounter.MAIN), last)
+        eq_(bump.call_count, 1)
+
+    def test_several_months(self, run_indexer, bump):
+        """Opinions go to the month they were created in, not yesterday's."""
+        run_indexer.return_value = True
+        last = self.delta(datetime(2010, 5, 31, 23), datetime(2010, 6, 1, 1))
+        merge_delta()
+        eq_([c[0] for c in run_indexer.call_args_list],
+            [('--rotate', 'opinions_2010_05'),
+             ('--rotate', 'opinions_2010_06'),
+             ('--rotate', 'opinions_delta')])
+        eq_(counter(SphinxCounter.MAIN), last)
+
+    def test_failed_rebuild(self, run_indexer, bump):
+        """Opinions stay in the delta until their month is rebuilt."""
+        run_indexer.side_effect = lambda *args: 'opinions_2010_06' not in args
+        self.delta(datetime(2010, 5, 31, 23), datetime(2010, 6, 1, 1))
+        merge_delta()
+        eq_(counter(SphinxCounter.MAIN), 0)
+        eq_(bump.call_count, 0)
+
+    @patch.object(settings._wrapped, 'SPHINX_PARTITION_END', None)
+    def test_next_partition(self, run_indexer, bump):
+        """Next month's partition is built before queries go to it."""
+        run_indexer.return_value = True
+        merge_delta()
+        today = date.today()
+        if today.month == 12:
+            name = partition_name(today.year + 1, 1)
+        else:
+            name = partition_name(today.year, today.month + 1)
+        run_indexer.assert_called_with('--rotate', name)
+
+
+class TestUpdateRollups(test_utils.TestCase):
+    def test_local_days(self):
+        """Opinions are rolled up by the local day they were created on."""
+        today = date.today()
+        yesterday = today - timedelta(days=1)
+        for created in (datetime.combine(yesterday, time(23, 30)),
+                        datetime.combine(today, time(0, 30)),
+                        datetime.combine(today, time(1, 30))):
+            o = Opinion.objects.create(product=1, description='Rollup',
+                                       _type=input.OPINION_PRAISE.id)
+            Opinion.objects.filter(pk=o.pk).update(created=created)
+        update_rollups()
+        eq_(sorted(OpinionRollup.objects.values_list('day', 'count')),
+            [(time_as_int(yesterday), 1), (time_as_int(today), 2)])
+
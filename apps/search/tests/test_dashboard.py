@@ -4,7 +4,7 @@ import jingo
 import jinja2
 import test_utils
 from jingo import register
-from mock import Mock
+from mock import Mock, patch
 from nose.tools import eq_
 from pyquery import PyQuery as pq
 
@@ -12,6 +12,7 @@ import input
 from feedback.cron import populate
 from input.tests import InputTestCase, render
 from input.urlresolvers import reverse
+from search import helpers
 from search.tests import SphinxTestCase
 
 
@@ -119,6 +120,39 @@ class TestHelpers(InputTestCase):
         doc = pq(r)
         eq_(doc('input').attr('id'), 'device_TacoTruck')
 
+    def test_fragment_cache(self):
+        """Blocks with the same input data are rendered once."""
+        req = self.factory.get('/')
+        req.mobile_site = False
+        req.default_prod = input.FIREFOX
+        platforms = [dict(platform='mac', count=3)]
+        tpl = '{{ platforms_block(ps, 3, defaults=d) }}'
+        with patch('search.helpers.render_template') as render_template:
+            render_template.return_value = jinja2.Markup('<b>mac</b>')
+            for i in range(2):
+                eq_(render(tpl, dict(ps=platforms, d={}, request=req)),
+                    '<b>mac</b>')
+            eq_(render_template.call_count, 1)
+
+            render(tpl, dict(ps=platforms, d={'platform': 'mac'},
+                             request=req))
+            eq_(render_template.call_count, 2)
+
+    def test_layered_context(self):
+        """Blocks render the same on top of the context as on a copy."""
+        req = self.factory.get('/')
+        req.mobile_site = False
+        ctx = register.env.from_string('').new_context(dict(request=req, a=1))
+        layered = helpers.layered_context(ctx, b=2)
+        eq_((layered['a'], layered['b']), (1, 2))
+        assert 'c' not in layered
+        assert set(['a', 'b', 'request']) <= set(layered.keys())
+
+        tpl = 'search/opinion_count.html'
+        eq_(helpers.render_template(tpl, helpers.layered_context(ctx,
+                                                                 count=5)),
+            helpers.render_template(tpl, helpers.new_context(ctx, count=5)))
+
     def test_sites_block(self):
         site = Mock()
         site.url = 'http://youtube.com'
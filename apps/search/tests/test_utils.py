@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.http import QueryDict
+
+from mock import patch
+from nose.tools import eq_
+
+from search import cron
+from search.forms import ReporterSearchForm
+from search.utils import (hot_keys, hot_queries, normalize_query,
+                          record_query)
+
+
+def test_normalize_query():
+    """Equivalent searches normalize alike; pagination doesn't count."""
+    normalize = lambda qs: normalize_query(QueryDict(qs),
+                                           ReporterSearchForm.base_fields,
+                                           'firefox')
+    eq_(normalize('q=%20Crash%20Flash&locale=de&page=3&utm=x&platform='),
+        'locale=de&product=firefox&q=Crash+Flash')
+    eq_(normalize('locale=de&q=crash+flash&product=firefox'),
+        normalize('q=crash+flash&locale=de'))
+    # The term's case matters to the search.
+    assert normalize('q=url:*') != normalize('q=URL:*')
+    eq_(normalize('product=mobile'), 'product=mobile')
+
+
+def test_hot_queries():
+    """The most frequent searches come first; forgotten ones are dropped."""
+    queries = ('a=1', 'b=2', 'b=2', 'c=3', 'c=3', 'c=3')
+    cache.delete_many(sum([list(hot_keys(q)) for q in queries], []))
+    for query_string in queries:
+        record_query(query_string)
+    eq_(hot_queries(2), ['c=3', 'b=2'])
+
+    cache.delete(hot_keys('c=3')[0])
+    eq_(hot_queries(5), ['b=2', 'a=1'])
+
+
+@patch.object(settings._wrapped, 'SEARCH_HOT_TRACKED', 1)
+def test_hot_queries_slots():
+    """Searches sharing a slot push each other out of the index."""
+    cache.delete_many(hot_keys('a=1') + hot_keys('b=2'))
+    record_query('a=1')
+    record_query('b=2')
+    eq_(hot_queries(5), ['b=2'])
+
+
+@patch('search.cron.hot_queries')
+@patch('search.client.Client.query')
+def test_warm_search_cache(query, hot):
+    """Hot searches are rerun."""
+    hot.return_value = ['product=mobile&q=crash']
+    query.return_value = []
+    cron.warm_search_cache()
+    eq_(query.call_args[0], (u'crash',))
+    eq_(query.call_args[1]['product'], 2)
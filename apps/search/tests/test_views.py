@@ -1,19 +1,25 @@
 # -*- coding: utf-8 -*-
+import csv
 import datetime
+import json
+from cStringIO import StringIO
 
+from django.conf import settings
 from django.contrib.sites.models import Site
+from django.http import QueryDict
 from django.test.client import Client as TestClient
 
 from mock import patch, Mock
 from nose.tools import eq_
 from pyquery import PyQuery as pq
+from test_utils import TestCase
 
 from input import (FIREFOX, OPINION_PRAISE, OPINION_ISSUE, OPINION_IDEA,
-                   OPINION_TYPES_USAGE)
+                   OPINION_TYPES_USAGE, MOBILE)
 from input.urlresolvers import reverse
 from feedback.cron import populate
-from feedback.models import Opinion
-from search import views, forms
+from feedback.models import Opinion, VersionCount
+from search import context_processors, views, forms
 from search.tests import SphinxTestCase
 from search.client import SearchError
 
@@ -34,6 +40,23 @@ def test_get_period():
     assert f.is_valid()
     eq_(views.get_period(f), ('1d', 1))
 
+    # No dates are the last SEARCH_DEFAULT_DAYS, unless all are asked for.
+    f = forms.ReporterSearchForm(dict(q='crash'))
+    assert f.is_valid()
+    eq_(views.get_period(f), (None, settings.SEARCH_DEFAULT_DAYS))
+    f = forms.ReporterSearchForm(dict(all_dates='True'))
+    assert f.is_valid()
+    eq_(views.get_period(f), ('infin', 0))
+
+
+def test_sentiment_bucket():
+    """Short periods chart by the hour, long ones by the week or month."""
+    eq_(views.sentiment_bucket('1d', 1), 'hour')
+    eq_(views.sentiment_bucket('7d', 7), 'day')
+    eq_(views.sentiment_bucket('custom', 120), 'week')
+    eq_(views.sentiment_bucket('custom', 400), 'month')
+    eq_(views.sentiment_bucket('infin', 0), 'month')
+
 
 def search_request(product='firefox', **kwargs):
     kwargs['product'] = product
@@ -76,6 +99,16 @@ class PaginationTest(SphinxTestCase):
             eq_(r.status_code, 200)
             eq_(r.context['form'].cleaned_data['page'], 1)
 
+    def test_bogus_pages(self):
+        """Bogus pages don't end up cached as the first page."""
+        first = pq(search_request().content)('.message').text()
+        for page in (0, 'abc'):
+            r = search_request(page=page)
+            eq_(r.status_code, 200)
+            msgs = pq(r.content)('.message').text()
+            assert not msgs or msgs == first
+            eq_(pq(search_request().content)('.message').text(), first)
+
     def test_page_2(self):
         self.compare_2_pages(1, 2)
 
@@ -89,6 +122,25 @@ class PaginationTest(SphinxTestCase):
         r = search_request(page=700)
         self.failUnlessEqual(r.status_code, 200)
 
+    def test_cursor(self):
+        """A page's cursor leads to the same results as the next page."""
+        r = search_request()
+        count = r.context['opinion_count']
+        cursor = r.context['next_cursor']
+        assert cursor
+        assert 'cursor=' in pq(r.content)('.pager a.older').attr('href')
+
+        r = search_request(page=2)
+        by_page = pq(r.content)('.message').text()
+        r = search_request(cursor=cursor)
+        eq_(pq(r.content)('.message').text(), by_page)
+        # Cursor pages count all results, not just the ones left.
+        eq_(r.context['opinion_count'], count)
+
+    def test_bogus_cursor(self):
+        r = search_request(cursor='bogus')
+        eq_(r.status_code, 200)
+
 
 class SearchViewTest(SphinxTestCase):
     """Tests relating to the search template rendering."""
@@ -125,6 +177,60 @@ class SearchViewTest(SphinxTestCase):
         doc = pq(r.content)
         assert count > len(doc('.message')) or len(doc('.message')) == 20
 
+    @patch.object(settings._wrapped, 'SEARCH_EXPORT_BATCH', 7)
+    def test_export(self):
+        """Exports page through all results, in batches."""
+        params = dict(product='firefox', version='--')
+        r = TestClient().get(reverse('search.export', args=['csv']), params)
+        eq_(r['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.reader(StringIO(r.content)))
+        eq_(rows[0][:2], ['id', 'created'])
+        eq_(len(rows) - 1, 36)
+        eq_(len(set(row[0] for row in rows[1:])), 36)
+
+        r = TestClient().get(reverse('search.export', args=['json']), params)
+        lines = [json.loads(l) for l in r.content.splitlines()]
+        eq_(len(lines), 36)
+        eq_(lines[0]['product'], 'firefox')
+
+    def test_export_invalid(self):
+        """Bad input is rejected instead of exporting everything."""
+        url = reverse('search.export', args=['csv'])
+        params = dict(product='firefox', version='--', date_start='bogus')
+        eq_(TestClient().get(url, params).status_code, 400)
+        params = dict(product='firefox', version='--', locale='bogus')
+        eq_(TestClient().get(url, params).status_code, 400)
+
+    @patch.object(settings._wrapped, 'SEARCH_EXPORT_BATCH', 7)
+    def test_export_search_error(self):
+        """Errors fail the export up front, or end it cleanly later on."""
+        params = dict(product='firefox', version='--')
+        url = reverse('search.export', args=['json'])
+        with patch('search.views.ExportClient.query') as query:
+            query.side_effect = SearchError('boom')
+            eq_(TestClient().get(url, params).status_code, 500)
+
+        query = views.ExportClient.query.im_func
+        calls = []
+
+        def flaky(self, *args, **kwargs):
+            calls.append(1)
+            if len(calls) > 1:
+                raise SearchError('boom')
+            return query(self, *args, **kwargs)
+
+        with patch.object(views.ExportClient, 'query', flaky):
+            r = TestClient().get(url, params)
+        eq_(r.status_code, 200)
+        eq_(len(r.content.splitlines()), 7)
+
+    def test_export_uncached(self):
+        """Exports don't fill the search result cache."""
+        params = dict(product='firefox', version='--')
+        with patch('search.client.cache.set_many') as set_many:
+            TestClient().get(reverse('search.export', args=['csv']), params)
+            assert not set_many.called
+
     def test_filter_happy(self):
         r = search_request(sentiment='happy')
         doc = pq(r.content)
@@ -216,6 +322,8 @@ class SearchViewTest(SphinxTestCase):
             else:
                 assert link.find('date_start') == -1
             assert link.find('date_end') == -1  # Never add end date.
+            # Only infinity asks for all dates.
+            eq_(link.find('all_dates') >= 0, n == 3)
 
     def test_bogus_parameters(self):
         """
@@ -309,3 +417,45 @@ def test_get_results(is_valid):
     request.default_prod = FIREFOX
     r = views._get_results(request)
     eq_(r[2], request.default_prod)
+
+
+def test_search_cache_key():
+    """Equivalent searches share a cached page, different ones don't."""
+    def key(qs, prod=FIREFOX):
+        request = Mock()
+        request.GET = QueryDict(qs)
+        request.default_prod = prod
+        return views.search_cache_key(request)
+
+    eq_(key('product=firefox&q=crash&version=--'),
+        key('q=crash&version=--&locale=&page=1&utm_source=x'))
+    assert key('q=crash&version=--') != key('q=crash&version=--', MOBILE)
+    assert key('') != key('product=firefox')
+    assert key('q=crash') != key('q=Crash')
+    # Bogus pages are shown as page 1.
+    eq_(key('q=crash&page=0'), key('q=crash'))
+    eq_(key('q=crash&page=abc'), key('q=crash'))
+    assert key('q=crash&page=2') != key('q=crash')
+
+
+class ProductVersionsTest(TestCase):
+
+    def test_memoized_until_versions_change(self):
+        """Version JSON is built lazily and rebuilt when VersionCount changes."""
+        with patch.object(context_processors, 'prod_versions_json') as pvj:
+            pvj.return_value = '{}'
+            ctx = context_processors.product_versions(None)
+            assert not pvj.called
+            eq_(unicode(ctx['PROD_VERSIONS_JSON']), u'{}')
+
+        context_processors._prod_versions.clear()
+        before = json.loads(context_processors.prod_versions_json())
+        assert '99.0' not in dict(before['firefox'])
+        with patch.object(VersionCount.objects, 'filter') as f:
+            context_processors.prod_versions_json()
+            assert not f.called
+
+        VersionCount.objects.create(product=FIREFOX.id, version='99.0',
+                                    num_opinions=1, active=True)
+        after = json.loads(context_processors.prod_versions_json())
+        assert '99.0' in dict(after['firefox'])
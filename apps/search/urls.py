@@ -6,4 +6,6 @@ from search import views
 urlpatterns = patterns('',
     url(r'^$', views.index, name='search'),
     url(r'^search/atom/?$', views.SearchFeed(), name='search.feed'),
+    url(r'^search/export\.(?P<format>csv|json)$', views.export,
+        name='search.export'),
 )
@@ -1,8 +1,11 @@
 # TODO(davedash): liberate from zamboni
 
 import subprocess
+from urllib import urlencode
 
 from django.conf import settings
+from django.core.cache import cache
+from django.utils.hashcompat import md5_constructor
 
 call = lambda x: subprocess.Popen(x, stdout=subprocess.PIPE).communicate()
 
@@ -20,6 +23,9 @@ def reindex(rotate=False):
 
     call(calls)[0]
 
+    from search.client import bump_index_generation
+    bump_index_generation()
+
 
 def start_sphinx():
     """
@@ -37,3 +43,70 @@ def stop_sphinx():
 
     call([settings.SPHINX_SEARCHD, '--stop', '--config',
           settings.SPHINX_CONFIG_PATH])[0]
+
+
+def run_indexer(*args):
+    """Runs the sphinx indexer with ``args``.  Returns True on success."""
+    p = subprocess.Popen([settings.SPHINX_INDEXER, '--config',
+                          settings.SPHINX_CONFIG_PATH] + list(args),
+                         stdout=subprocess.PIPE)
+    p.communicate()
+    return p.returncode == 0
+
+
+HOT_QUERIES_KEY = settings.CACHE_PREFIX + 'search:hot'
+
+
+def normalize_query(data, fields, default_product):
+    """
+    The canonical query string of the search form ``data`` (with form
+    ``fields``): sorted, without empty, unknown or pagination parameters,
+    and with the product spelled out.  The search term is kept as is, like
+    the search cache keys it (c.f. search.client.query_cache_key).
+    """
+    query = dict((k, v.strip()) for k, v in data.items()
+                 if k in fields and k not in ('page', 'cursor') and
+                 v.strip())
+    query.setdefault('product', default_product)
+    return urlencode(sorted((k, v.encode('utf-8'))
+                            for k, v in query.items()))
+
+
+def hot_keys(query_string):
+    """
+    The cache keys of a search's count and of the slot of the hot search
+    index it is listed in.
+    """
+    digest = md5_constructor(query_string).hexdigest()
+    slot = int(digest, 16) % settings.SEARCH_HOT_TRACKED
+    return ('%s:%s' % (HOT_QUERIES_KEY, digest),
+            '%s:slot:%d' % (HOT_QUERIES_KEY, slot))
+
+
+def record_query(query_string):
+    """
+    Counts a search (c.f. ``normalize_query``) towards the hot searches of
+    the last SEARCH_HOT_WINDOW seconds.  The counts are approximate.
+    """
+    (key, slot) = hot_keys(query_string)
+    if cache.add(key, 1, settings.SEARCH_HOT_WINDOW):
+        # The first search of its window lists it in its slot.
+        cache.set(slot, query_string, settings.SEARCH_HOT_WINDOW)
+    else:
+        try:
+            cache.incr(key)
+        except ValueError:
+            pass  # Its window just ended.
+
+
+def hot_queries(limit):
+    """The query strings of the ``limit`` most frequent recent searches."""
+    slots = ['%s:slot:%d' % (HOT_QUERIES_KEY, slot)
+             for slot in xrange(settings.SEARCH_HOT_TRACKED)]
+    listed = cache.get_many(slots).values()
+    keys = dict((hot_keys(query_string)[0], query_string)
+                for query_string in listed)
+    # Searches nobody made in the last window have no count.
+    counts = cache.get_many(keys.keys())
+    top = sorted(counts, key=counts.get, reverse=True)[:limit]
+    return [keys[key] for key in top]
@@ -1,11 +1,16 @@
+import csv
 import datetime
 import json
 import time
+from cStringIO import StringIO
+from functools import wraps
+from urllib import urlencode
 
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.contrib.syndication.views import Feed
 from django.core.paginator import Paginator, InvalidPage, EmptyPage
+from django.http import HttpResponse, HttpResponseBadRequest
 from django.shortcuts import render
 from django.utils.feedgenerator import Atom1Feed
 
@@ -18,15 +23,21 @@ from input import (PRODUCTS, PRODUCT_IDS, FIREFOX, MOBILE, LATEST_BETAS,
                    OPINION_PRAISE, OPINION_ISSUE, OPINION_IDEA, OPINION_TYPES)
 from input.decorators import cache_page, forward_mobile
 from input.urlresolvers import reverse
-from feedback.models import VersionCount
-from search.client import Client, SearchError
+from input.utils import id_order
+from feedback.models import Opinion, VersionCount
+from search.client import Client, SearchError, decode_cursor
 from search.forms import ReporterSearchForm, PROD_CHOICES
+from search.utils import normalize_query, record_query
 
 log = commonware.log.getLogger('i.search')
 
 
 unixtime = lambda s: int(time.mktime(time.strptime(s, '%Y-%m-%d')))
 
+# Facets shown on the dashboard.
+DASHBOARD_META = ('type', 'locale', 'platform', 'day_sentiment',
+                  'manufacturer', 'device')
+
 
 def _get_results(request, meta=[], client=None):
     form = ReporterSearchForm(request.GET)
@@ -36,6 +47,7 @@ def _get_results(request, meta=[], client=None):
         product = data.get('product') or request.default_prod.short
         version = data.get('version')
         search_opts = _get_results_opts(request, data, product, meta)
+        search_opts['bucket'] = sentiment_bucket(*get_period(form))
         type_filter = search_opts['type'] if 'type' in search_opts else None
         c = client or Client()
         opinions = c.query(query, **search_opts)
@@ -59,8 +71,9 @@ def _get_results_opts(request, data, product, meta=[]):
     search_opts = data
     search_opts['product'] = PRODUCTS[product].id
     search_opts['meta'] = meta
-    search_opts['offset'] = ((data.get('page', 1) - 1) *
+    search_opts['offset'] = (((data.get('page') or 1) - 1) *
                              settings.SEARCH_PERPAGE)
+    search_opts['after'] = decode_cursor(data.get('cursor'))
 
     sentiment = data.get('sentiment', '')
     if sentiment == 'happy':
@@ -92,9 +105,20 @@ def get_sentiment(data=[]):
     return r
 
 
+class CursorAtom1Feed(Atom1Feed):
+    """Atom feed linking to its next page (RFC 5005), if there is one."""
+
+    def add_root_elements(self, handler):
+        super(CursorAtom1Feed, self).add_root_elements(handler)
+        if self.feed.get('next_link'):
+            handler.addQuickElement(u'link', u'',
+                                    {u'rel': u'next',
+                                     u'href': self.feed['next_link']})
+
+
 class SearchFeed(Feed):
     # TODO(davedash): Gracefully degrade for unavailable search.
-    feed_type = Atom1Feed
+    feed_type = CursorAtom1Feed
 
     author_name = _lazy('Firefox Input')
     subtitle = _lazy("Search Results in Firefox Beta Feedback.")
@@ -108,6 +132,18 @@ class SearchFeed(Feed):
         return u'%s?%s' % (reverse('search'),
                            obj['request'].META['QUERY_STRING'])
 
+    def feed_extra_kwargs(self, obj):
+        """Link to the next page of results using a pagination cursor."""
+        cursor = getattr(obj['opinions'], 'next_cursor', None)
+        if not cursor:
+            return {}
+        params = [(k, v) for k, v in obj['request'].GET.items()
+                  if k not in ('page', 'cursor')]
+        params.append(('cursor', cursor))
+        return {'next_link': u'%s?%s' % (
+            reverse('search.feed'),
+            urlencode([(k, unicode(v).encode('utf-8')) for k, v in params]))}
+
     def title(self, obj):
         """Global feed title."""
         request = obj['request']
@@ -154,10 +190,10 @@ class SearchFeed(Feed):
 def get_defaults(form):
     """
     Keep form data as default options for further searches, but remove page
-    from defaults so that every parameter change returns to page 1.
+    and cursor from defaults so that every parameter change returns to page 1.
     """
     return dict((k, v) for k, v in form.data.items()
-                if k != 'page' and k in form.fields)
+                if k not in ('page', 'cursor') and k in form.fields)
 
 
 def get_period(form):
@@ -171,8 +207,10 @@ def get_period(form):
     start = d.get('date_start')
     end = d.get('date_end') or datetime.date.today()
 
-    if not (start and end):
+    if not start and d.get('all_dates'):
         return 'infin', days
+    elif not (start and end):
+        return None, settings.SEARCH_DEFAULT_DAYS
 
     _ago = lambda x: datetime.date.today() - datetime.timedelta(days=x)
     days = (end - start).days
@@ -185,8 +223,54 @@ def get_period(form):
     return 'custom', days
 
 
+def sentiment_bucket(period, days):
+    """Time granularity of the sentiment chart for a ``get_period`` result,
+    keeping the number of points on it bounded."""
+    if period == '1d':
+        return 'hour'
+    elif period == 'infin' or days > 365:
+        return 'month'
+    elif days > 90:
+        return 'week'
+    return 'day'
+
+
+def search_cache_key(request):
+    """
+    The page cache key of a search: its cleaned form data with defaults
+    filled in, so that URLs for the same search share the cached page.
+    """
+    form = ReporterSearchForm(request.GET)
+    form.is_valid()
+    data = dict((k, v) for k, v in form.cleaned_data.items()
+                if v not in (None, ''))
+    data['product'] = data.get('product') or request.default_prod.short
+    # Bogus pages are shown as the first page.
+    if data.get('page') == 1:
+        del data['page']
+    # The dashboard (no parameters at all) looks different.
+    return repr((bool(request.GET), sorted(data.items())))
+
+
+def record_search(f):
+    """
+    Counts first pages of searches, cached or not, towards the hot searches
+    the warm_search_cache cron keeps fresh.
+    """
+    @wraps(f)
+    def wrapped(request, *args, **kwargs):
+        if (request.GET.get('page', '1') == '1' and
+            not request.GET.get('cursor')):
+            record_query(normalize_query(request.GET,
+                                         ReporterSearchForm.base_fields,
+                                         request.default_prod.short))
+        return f(request, *args, **kwargs)
+    return wrapped
+
+
 @forward_mobile
-@cache_page(use_get=True)
+@record_search
+@cache_page(get_key=search_cache_key, grace=settings.CACHE_DEFAULT_PERIOD)
 def index(request):
     """
     Display search results for Opinions on Firefox. Shows breakdown of
@@ -209,18 +293,19 @@ def index(request):
     }
 
     try:
-        meta = ('type', 'locale', 'platform', 'day_sentiment', 'manufacturer',
-                'device')
         (results, form, product, version, metas, type_filter) = _get_results(
-                request, meta=meta)
+                request, meta=DASHBOARD_META)
     except SearchError, e:
         return render(request, 'search/unavailable.html', {'search_error': e},
                       status=500)
 
-    page = form.data.get('page', 1)
+    # The page search_cache_key keys on, i.e. the cleaned one: the results
+    # only hold that page's offset.
+    page = getattr(form, 'cleaned_data', {}).get('page') or 1
+    after = decode_cursor(form.data.get('cursor'))
 
     # Are people going past the first page?
-    if page > 1:
+    if page > 1 or after:
         statsd.incr('search.paginating')
 
     # Get the desktop site's absolute URL for use in the settings tab
@@ -246,7 +331,13 @@ def index(request):
 
     data['period'], days = get_period(form)
 
-    if results:
+    if results and after:
+        # Cursor pages follow the previous page's last opinion and have no
+        # page number.
+        data['opinion_count'] = len(results)
+        data['page'] = None
+        data['opinions'] = list(results)
+    elif results:
         pager = Paginator(results, settings.SEARCH_PERPAGE)
         data['opinion_count'] = pager.count
         # If page request (e.g., 9999) is out of range, deliver last page of
@@ -257,14 +348,21 @@ def index(request):
             data['page'] = pager.page(pager.num_pages)
 
         data['opinions'] = data['page'].object_list
-        data['sent'] = get_sentiment(metas.get('type', {}))
+
+    if results:
+        data['next_cursor'] = results.next_cursor
+        # Facets can be unavailable (None) if their query timed out.
+        data['sent'] = get_sentiment(metas.get('type') or {})
         data['demo'] = dict(locale=metas.get('locale'),
                             platform=metas.get('platform'),
                             manufacturer=metas.get('manufacturer'),
                             device=metas.get('device'))
-        if days >= 7 or data['period'] == 'infin':
-            daily = metas.get('day_sentiment', {})
-            if type_filter:
+        if days >= 7 or data['period'] in ('1d', 'infin'):
+            data['chart_bucket'] = sentiment_bucket(data['period'], days)
+            daily = metas.get('day_sentiment') or {}
+            if not daily:
+                chart_data = None
+            elif type_filter:
                 opinion = OPINION_TYPES[type_filter]
                 chart_data = dict(series=[dict(name=unicode(opinion.pretty),
                         data=daily[opinion.short])])
@@ -274,7 +372,7 @@ def index(request):
                     dict(name=_('Issues'), data=daily['issue']),
                     dict(name=_('Ideas'), data=daily['idea']),
                     ]
-                ) if daily else None
+                )
             data['chart_data_json'] = json.dumps(chart_data)
     else:
         data.update({
@@ -288,3 +386,118 @@ def index(request):
     template = 'search/%ssearch.html' % (
         'mobile/' if request.mobile_site else '')
     return render(request, template, data)
+
+
+EXPORT_FIELDS = ('id', 'created', 'type', 'product', 'version', 'platform',
+                 'locale', 'manufacturer', 'device', 'url', 'description')
+
+
+class ExportClient(Client):
+    """Search client reading opinions straight from the DB and bypassing
+    the search result cache, so that big exports don't push everything
+    else out of the caches."""
+    use_cache = False
+
+    def fetch_opinions(self, opinion_ids):
+        return id_order(Opinion.objects.no_cache(), opinion_ids)
+
+
+def _export_batch(query, search_opts, after=None):
+    opts = dict(search_opts, meta=[], offset=0, after=after,
+                limit=settings.SEARCH_EXPORT_BATCH)
+    return ExportClient().query(query, **opts)
+
+
+def _export_opinions(query, search_opts):
+    """
+    Generator of all opinions matching a search, in batches.  The first
+    batch is read right away, so that a SearchError is raised before the
+    response starts.  Later errors end the export early.
+    """
+    results = _export_batch(query, search_opts)
+
+    def opinions(results):
+        while True:
+            for opinion in results:
+                yield opinion
+
+            if not results or not results.next_cursor:
+                break
+            try:
+                results = _export_batch(query, search_opts,
+                                        decode_cursor(results.next_cursor))
+            except SearchError, e:
+                statsd.incr('search.export.errors')
+                log.error('Export cut short by a search error: %s' % e)
+                break
+
+    return opinions(results)
+
+
+def _export_row(opinion):
+    return dict(
+        id=opinion.id,
+        created=opinion.created.isoformat(),
+        type=getattr(OPINION_TYPES.get(opinion._type), 'short', None),
+        product=getattr(PRODUCT_IDS.get(opinion.product), 'short', None),
+        version=opinion.version,
+        platform=opinion.platform,
+        locale=opinion.locale,
+        manufacturer=opinion.manufacturer,
+        device=opinion.device,
+        url=opinion.url,
+        description=opinion.description)
+
+
+def _export_csv(opinions):
+    buf = StringIO()
+    writer = csv.writer(buf)
+
+    def line(values):
+        buf.seek(0)
+        buf.truncate()
+        writer.writerow([unicode(v).encode('utf-8') if v is not None else ''
+                         for v in values])
+        return buf.getvalue()
+
+    yield line(EXPORT_FIELDS)
+    for opinion in opinions:
+        row = _export_row(opinion)
+        yield line(row[f] for f in EXPORT_FIELDS)
+
+
+def _export_json(opinions):
+    for opinion in opinions:
+        yield json.dumps(_export_row(opinion)) + '\n'
+
+
+def export(request, format):
+    """
+    Stream all opinions matching a search (same parameters as the
+    dashboard) as CSV or JSON lines.  Results are read from searchd in
+    batches, so memory use doesn't depend on the size of the export.
+    """
+    form = ReporterSearchForm(request.GET)
+    # The form swallows its errors, but an export of everything isn't a
+    # good answer to bad input.
+    if not form.is_valid() or form.invalid_fields:
+        return HttpResponseBadRequest(_('Invalid search parameters.'))
+    data = form.cleaned_data
+    product = data.get('product') or request.default_prod.short
+    search_opts = _get_results_opts(request, data, product)
+    try:
+        opinions = _export_opinions(data.get('q', ''), search_opts)
+    except SearchError, e:
+        return render(request, 'search/unavailable.html', {'search_error': e},
+                      status=500)
+
+    statsd.incr('search.export.%s' % format)
+    if format == 'csv':
+        response = HttpResponse(_export_csv(opinions),
+                                content_type='text/csv; charset=utf-8')
+    else:
+        response = HttpResponse(_export_json(opinions),
+                                content_type='application/json')
+    response['Content-Disposition'] = (
+        'attachment; filename=opinions.%s' % format)
+    return response
@@ -23,6 +23,8 @@ ETC_PATH          = os.path.dirname(settings.SPHINX_CONFIG_PATH)
 LISTEN_PORT       = settings.SPHINX_PORT
 MYSQL_LISTEN_PORT = settings.SPHINXQL_PORT
 MYSQL_LISTEN_HOST = 'localhost'
+PARTITION_START   = settings.SPHINX_PARTITION_START
+PARTITION_END     = settings.SPHINX_PARTITION_END
 
 if MYSQL_HOST.endswith('.sock'):
     MYSQL_HOST = 'localhost'
@@ -33,3 +35,5 @@ if os.environ.get('DJANGO_ENVIRONMENT') == 'test':
     MYSQL_LISTEN_PORT = settings.TEST_SPHINXQL_PORT
     CATALOG_PATH      = settings.TEST_SPHINX_CATALOG_PATH
     LOG_PATH          = settings.TEST_SPHINX_LOG_PATH
+    PARTITION_START   = settings.TEST_SPHINX_PARTITION_START
+    PARTITION_END     = settings.TEST_SPHINX_PARTITION_END
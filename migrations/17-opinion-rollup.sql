@@ -0,0 +1,14 @@
+CREATE TABLE `opinion_rollup` (
+    `id` integer AUTO_INCREMENT NOT NULL PRIMARY KEY,
+    `day` integer UNSIGNED NOT NULL,
+    `product` smallint UNSIGNED NOT NULL,
+    `version` varchar(30) NOT NULL,
+    `platform` varchar(30) NOT NULL,
+    `locale` varchar(30) NOT NULL,
+    `type` smallint UNSIGNED NOT NULL,
+    `manufacturer` varchar(255) NOT NULL,
+    `device` varchar(255) NOT NULL,
+    `count` integer UNSIGNED NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+CREATE INDEX `opinion_rollup_day` ON `opinion_rollup` (`day`);
+CREATE INDEX `opinion_rollup_product_day` ON `opinion_rollup` (`product`, `day`);
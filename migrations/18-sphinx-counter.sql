@@ -0,0 +1,7 @@
+CREATE TABLE `sphinx_counter` (
+    `counter_id` integer UNSIGNED NOT NULL PRIMARY KEY,
+    `max_doc_id` integer UNSIGNED NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8;
+-- Everything indexed so far is in the main partitions.
+INSERT INTO `sphinx_counter` SELECT 1, COALESCE(MAX(`id`), 0) FROM `feedback_opinion`;
+INSERT INTO `sphinx_counter` SELECT 2, COALESCE(MAX(`id`), 0) FROM `feedback_opinion`;
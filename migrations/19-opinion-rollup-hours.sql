@@ -0,0 +1,7 @@
+-- Rollups are per hour now; rebuild them with the update_rollups cron.
+DELETE FROM `opinion_rollup`;
+DROP INDEX `opinion_rollup_day` ON `opinion_rollup`;
+DROP INDEX `opinion_rollup_product_day` ON `opinion_rollup`;
+ALTER TABLE `opinion_rollup` CHANGE `day` `hour` integer UNSIGNED NOT NULL;
+CREATE INDEX `opinion_rollup_hour` ON `opinion_rollup` (`hour`);
+CREATE INDEX `opinion_rollup_product_hour` ON `opinion_rollup` (`product`, `hour`);
@@ -0,0 +1,8 @@
+-- Rollups are per (local) day again; rebuild them with the update_rollups
+-- cron.
+DELETE FROM `opinion_rollup`;
+DROP INDEX `opinion_rollup_hour` ON `opinion_rollup`;
+DROP INDEX `opinion_rollup_product_hour` ON `opinion_rollup`;
+ALTER TABLE `opinion_rollup` CHANGE `hour` `day` integer UNSIGNED NOT NULL;
+CREATE INDEX `opinion_rollup_day` ON `opinion_rollup` (`day`);
+CREATE INDEX `opinion_rollup_product_day` ON `opinion_rollup` (`product`, `day`);
@@ -7,6 +7,15 @@ DATABASE_ROUTERS = ('website_issues.db.DatabaseRouter',
 
 CACHE_DEFAULT_PERIOD = CACHE_MIDDLEWARE_SECONDS = 60 * 5  # 5 minutes
 CACHE_COUNT_TIMEOUT = 60  # seconds
+# While one request renders a page for the cache (c.f.
+# input.decorators.cache_page), others for it wait up to CACHE_PAGE_WAIT
+# seconds.  Its lock expires after CACHE_PAGE_LOCK_TIMEOUT seconds.
+CACHE_PAGE_WAIT = 5
+CACHE_PAGE_LOCK_TIMEOUT = 30
+# Pre-rendered dashboard sidebar blocks, c.f. search.helpers.render_cached.
+FRAGMENT_CACHE_TIMEOUT = 60 * 60
+# Opinions don't change after they are saved, so cache them for a long time.
+OPINION_CACHE_TIMEOUT = 60 * 60 * 24
 CACHE_PREFIX = CACHE_MIDDLEWARE_KEY_PREFIX = 'reporter:'
 
 # Site ID.
@@ -129,6 +138,30 @@ JAVA_BIN = '/usr/bin/java'
 
 JINGO_EXCLUDE_APPS = ['debug_toolbar', 'admin', 'adminplus']
 
+# Compiled templates are cached here, shared by all workers.  Fill it with
+# ./manage.py precompile_templates on deploy.  None disables it.
+JINJA_BYTECODE_CACHE_DIR = path('tmp/jinja')
+# Compile all templates when the WSGI app is loaded, not on first use.
+PRECOMPILE_TEMPLATES = False
+
+_base_jinja_config = JINJA_CONFIG
+
+
+def JINJA_CONFIG():
+    import jinja2
+    from django.conf import settings
+
+    base = _base_jinja_config
+    config = dict(base() if callable(base) else base)
+    # Room for all our templates, so they aren't recompiled over and over.
+    config['cache_size'] = 400
+    cache_dir = settings.JINJA_BYTECODE_CACHE_DIR
+    if cache_dir:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        config['bytecode_cache'] = jinja2.FileSystemBytecodeCache(cache_dir)
+    return config
+
 MIDDLEWARE_CLASSES = get_middleware(
     append=(
         'input.middleware.MobileSiteMiddleware',
@@ -175,6 +208,17 @@ PROD_DETAILS_DIR = path('lib/product_details_json')
 # Term filter options
 MIN_TERM_LENGTH = 3
 MAX_TERM_LENGTH = 25
+# Opinions per batch of the extract_terms cron.
+TERMS_BATCH = 500
+# Opinions saved out of order can end up below its mark; it looks for ones
+# without terms among this many ids below it.
+TERMS_RESCAN = 1000
+# Extracted terms of this many recent descriptions are kept in memory, per
+# process (0 to disable).
+TERMS_CACHE_SIZE = 1000
+
+# Parsed user agents kept in memory, per process (c.f. feedback.utils.ua_parse)
+UA_CACHE_SIZE = 5000
 
 # Number of items to show in the "Trends" box and Messages box.
 MESSAGES_COUNT = 10
@@ -189,15 +233,47 @@ SPHINX_INDEXER = 'indexer'
 SPHINX_CATALOG_PATH = path('tmp/data/sphinx')
 SPHINX_LOG_PATH = path('tmp/log/searchd')
 SPHINX_CONFIG_PATH = path('configs/sphinx/sphinx.conf')
+# Opinions are indexed in one partition per month, starting with this one
+# and ending with this one (None for the current month).
+SPHINX_PARTITION_START = (2010, 4)
+SPHINX_PARTITION_END = None
+# Persistent searchd connections kept per process, and how long (in seconds)
+# a request waits for one before giving up.
+SPHINX_POOL_SIZE = 10
+SPHINX_POOL_TIMEOUT = 5
 
 TEST_SPHINX_PORT = 3414
 TEST_SPHINXQL_PORT = 3409
 TEST_SPHINX_CATALOG_PATH = path('tmp/test/data/sphinx')
 TEST_SPHINX_LOG_PATH = path('tmp/test/log/searchd')
+# Only the months of the opinion fixtures.
+TEST_SPHINX_PARTITION_START = (2010, 5)
+TEST_SPHINX_PARTITION_END = (2010, 6)
 
 SEARCH_MAX_RESULTS = 1000
 SEARCH_PERPAGE = 20  # results per page
+# Searches without a date range cover this many days, unless they ask for
+# all of them.
+SEARCH_DEFAULT_DAYS = 60
 SEARCH_MAX_PAGES = SEARCH_MAX_RESULTS / SEARCH_PERPAGE
+# How long (in seconds) search results are cached below the view layer.
+# Index rotation makes them stale sooner.
+SEARCH_CACHE_TIMEOUT = 60 * 10
+# How long stale search results are still served while one request
+# recomputes them.
+SEARCH_CACHE_GRACE = 60 * 10
+# The warm_search_cache cron keeps the results of the SEARCH_WARM_QUERIES
+# most frequent searches of the last SEARCH_HOT_WINDOW seconds fresh.
+SEARCH_WARM_QUERIES = 50
+SEARCH_HOT_WINDOW = 60 * 60
+# It recomputes those going stale within this many seconds, i.e. before
+# its next run.
+SEARCH_WARM_AHEAD = 60 * 2
+# Slots for tracking distinct searches per window; searches sharing a slot
+# push each other out.
+SEARCH_HOT_TRACKED = 2000
+# Opinions fetched from searchd per batch by the streaming search export.
+SEARCH_EXPORT_BATCH = 500
 
 CLUSTER_SIM_THRESHOLD = 2
 
@@ -224,6 +300,21 @@ ES_DISABLED = True
 # (good for testing)
 ENFORCE_USER_AGENT = True
 DISABLE_TERMS = False
+# Only spool submitted feedback to OPINION_SPOOL_DIR in the feedback view,
+# and save it in batches of OPINION_SPOOL_BATCH. Needs the flush_opinions
+# cron to run.
+ASYNC_OPINIONS = False
+OPINION_SPOOL_DIR = path('tmp/opinions')
+OPINION_SPOOL_BATCH = 500
+# Answer the facets of empty-term dashboard searches from the opinion rollups
+# instead of searchd. Needs the update_rollups cron to run.
+SEARCH_ROLLUPS = False
+# Run each search facet concurrently on its own searchd connection (needs a
+# SPHINX_POOL_SIZE of at least 7 per concurrent request). A facet that takes
+# longer than SEARCH_META_TIMEOUT seconds is shown as unavailable.
+SEARCH_PARALLEL_METAS = False
+SEARCH_META_THREADS = 10
+SEARCH_META_TIMEOUT = 2
 
 # Minnum of opinions in the last 30 days for version to be shown in dashboard
 DASHBOARD_THRESHOLD = 800